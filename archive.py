@@ -0,0 +1,164 @@
+import os
+import json
+
+import pandas as pd
+
+from functions import (read_sensor_csv, parse_dates, save_frame, load_frame, file_hash, deduplicate_observations,
+                       sensor_daily_sums, valid_readings, complete_days, valid_values)
+
+# Out-of-core processing of the multi-year ARPA archive.
+# Sensor dumps are read in chunks and written to disk partitioned by year and sensor bucket
+# (IdSensore modulo the number of buckets):
+#   <archive_dir>/<year>/bucket-<b>/part-<n>/   one save_frame directory per chunk and partition
+#   <archive_dir>/archive.json                   bucket count and content hashes of the dumps ingested
+# Queries then load one partition at a time, reduce it to sums and counts, and combine the partial
+# results, so memory is bounded by the size of one partition rather than by the archive.
+# Readings are checked as in quality_check: the 'valid' flag is stored at ingest, and since a partition
+# holds whole sensor-days, day completeness is flagged when a partition is loaded.
+#
+#   partition_archive(sorted(glob.glob('archive/Dati_sensori_aria_*.csv')), 'data/archive')
+#   archive_sensor_avg('data/archive', pm_stations)         # as calculate_sensor_avg
+#   archive_sensor_yearly_avg('data/archive', pm_stations)  # as calculate_sensor_yearly_avg
+
+# sensor buckets per year; more buckets mean smaller partitions
+ARCHIVE_BUCKETS = 16
+
+
+# Function to read the archive manifest (or create it with the given number of sensor buckets)
+def _archive_manifest(archive_dir, buckets=None):
+    path = os.path.join(archive_dir, 'archive.json')
+    if os.path.exists(path):
+        with open(path) as f:
+            manifest = json.load(f)
+        manifest.setdefault('ingested', {})
+        return manifest
+    if buckets is None:
+        raise FileNotFoundError(f'no archive in {archive_dir}')
+    manifest = {'buckets': buckets, 'ingested': {}}
+    _write_manifest(archive_dir, manifest)
+    return manifest
+
+# Function to write the archive manifest atomically
+def _write_manifest(archive_dir, manifest):
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, 'archive.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+# Function to read the number of sensor buckets of an archive
+def _archive_buckets(archive_dir):
+    return _archive_manifest(archive_dir)['buckets']
+
+# Function to list the chunk directories of a partition in the order they were written
+def _partition_parts(directory):
+    if not os.path.isdir(directory):
+        return []
+    return sorted(part for part in os.listdir(directory) if part.startswith('part-') and not part.endswith('.tmp'))
+
+# Function to partition ARPA sensor dumps on disk by year and sensor bucket, one chunk at a time
+#   paths: sensor dumps, oldest first (where they overlap, later dumps win when the archive is read);
+#       dumps already in the archive (same content hash) are skipped
+#   returns the number of observations written
+def partition_archive(paths, archive_dir, buckets=ARCHIVE_BUCKETS, chunksize=1_000_000):
+    if isinstance(paths, str):
+        paths = [paths]
+    manifest = _archive_manifest(archive_dir, buckets)
+    buckets = manifest['buckets']
+    next_part = {}
+    written = 0
+    for path in paths:
+        digest = file_hash(path)
+        if digest in manifest['ingested']:
+            continue
+        reader = read_sensor_csv(path, chunksize=chunksize)
+        for chunk in reader:
+            chunk['timestamp'] = parse_dates(chunk['Data'])
+            chunk = pd.DataFrame({
+                'IdSensore': chunk['IdSensore'].to_numpy(),
+                'timestamp': chunk['timestamp'].to_numpy(),
+                # recode -9999.0 to NA
+                'Valore': chunk['Valore'].where(chunk['Valore'] != -9999.0).to_numpy(),
+                'Stato': chunk['Stato'].astype('category').to_numpy(),
+                'valid': valid_readings(chunk),
+            })
+            chunk = chunk[chunk['timestamp'].notna()]
+            years = chunk['timestamp'].dt.year.to_numpy()
+            bucket_ids = chunk['IdSensore'].to_numpy() % buckets
+            for (year, bucket), part in chunk.groupby([years, bucket_ids], sort=False):
+                directory = os.path.join(archive_dir, str(year), f'bucket-{bucket:03d}')
+                if directory not in next_part:
+                    next_part[directory] = len(_partition_parts(directory))
+                save_frame(part.reset_index(drop=True), os.path.join(directory, f'part-{next_part[directory]:06d}'))
+                next_part[directory] += 1
+                written += len(part)
+        # recorded once the whole dump is in, so an interrupted ingest is redone
+        manifest['ingested'][digest] = os.path.basename(path)
+        _write_manifest(archive_dir, manifest)
+    return written
+
+# Function to list the partitions holding some sensors over a date range
+def _archive_partitions(archive_dir, sensors=None, start_date=None, end_date=None):
+    buckets = _archive_buckets(archive_dir)
+    wanted = None if sensors is None else {int(sensor) % buckets for sensor in sensors}
+    start_year = pd.Timestamp(start_date).year if start_date is not None else None
+    end_year = pd.Timestamp(end_date).year if end_date is not None else None
+    for year in sorted(entry for entry in os.listdir(archive_dir) if entry.isdigit()):
+        if (start_year and int(year) < start_year) or (end_year and int(year) > end_year):
+            continue
+        for bucket in sorted(os.listdir(os.path.join(archive_dir, year))):
+            if wanted is None or int(bucket.split('-')[1]) in wanted:
+                yield os.path.join(archive_dir, year, bucket)
+
+# Function to load the observations of one partition, newest dump winning for repeated readings
+def _load_partition(directory, sensors=None, start_date=None, end_date=None):
+    frames = [load_frame(os.path.join(directory, part)) for part in _partition_parts(directory)]
+    data = pd.concat(frames, ignore_index=True)
+    if sensors is not None:
+        data = data[data['IdSensore'].isin(sensors)]
+    if start_date is not None:
+        data = data[data['timestamp'] >= pd.to_datetime(start_date)]
+    if end_date is not None:
+        # include the whole end day
+        data = data[data['timestamp'] < pd.to_datetime(end_date) + pd.Timedelta(days=1)]
+    data = deduplicate_observations(data)
+    return data.assign(day_complete=complete_days(data))
+
+# Function to compute per-sensor daily sums and counts over the archive, one partition at a time
+#   returns the same table as sensor_daily_sums (IdSensore, date, sum, count)
+def archive_daily_sums(archive_dir, sensors=None, start_date=None, end_date=None):
+    sums = [sensor_daily_sums(_load_partition(directory, sensors, start_date, end_date))
+            for directory in _archive_partitions(archive_dir, sensors, start_date, end_date)]
+    if not sums:
+        return pd.DataFrame({'IdSensore': pd.Series(dtype='int32'), 'date': pd.Series(dtype='datetime64[ns]'),
+                             'sum': pd.Series(dtype='float64'), 'count': pd.Series(dtype='int64')})
+    return pd.concat(sums, ignore_index=True).sort_values(['IdSensore', 'date']).reset_index(drop=True)
+
+# Function to pool the readings of some sensors by day or by year, combining per-partition sums and counts
+def _archive_group_sums(archive_dir, sensors, key, start_date=None, end_date=None):
+    partial = []
+    for directory in _archive_partitions(archive_dir, sensors, start_date, end_date):
+        data = _load_partition(directory, sensors, start_date, end_date)
+        keys = data['timestamp'].dt.normalize() if key == 'date' else data['timestamp'].dt.year
+        partial.append(valid_values(data).groupby(keys.rename(key)).agg(['sum', 'count']))
+    if not partial:
+        return pd.DataFrame({key: [], 'Valore': []})
+    # a day or year is spread over the sensor buckets: add up the partial sums and counts
+    totals = pd.concat(partial).groupby(level=0, sort=True).sum()
+    means = totals['sum'] / totals['count'].where(totals['count'] > 0)
+    return means.rename('Valore').reset_index()
+
+# Function to compute daily means of a group of stations over the archive (as calculate_sensor_avg on
+# the snapshots after quality_check)
+def archive_sensor_avg(archive_dir, pm_stations, start_date=None, end_date=None):
+    mean_pm_data = _archive_group_sums(archive_dir, pm_stations, 'date', start_date, end_date)
+    # Extract just the date part
+    mean_pm_data['date'] = pd.to_datetime(mean_pm_data['date']).dt.date
+    return mean_pm_data
+
+# Function to compute yearly means of a group of stations over the archive (as calculate_sensor_yearly_avg
+# on the snapshots after quality_check)
+def archive_sensor_yearly_avg(archive_dir, pm_stations, start_date=None, end_date=None):
+    mean_pm_data = _archive_group_sums(archive_dir, pm_stations, 'year', start_date, end_date)
+    mean_pm_data['year'] = mean_pm_data['year'].astype('int32')
+    return mean_pm_data
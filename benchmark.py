@@ -0,0 +1,206 @@
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from functions import (DATE_FORMAT, SENSOR_TYPES, MILAN_PM25_STATIONS, MILAN_PM10_STATIONS, PLOT_FUNCTIONS,
+                       load_sensor_data, compact_observations, pm25_sensors_avg, pm25_sensors_yearly_avg,
+                       pm10_sensors_avg, calculate_sensor_avg, calculate_sensor_yearly_avg, station_groups,
+                       aggregate_station_groups, render_charts)
+
+# Synthetic ARPA-shaped data and benchmarks for functions.py.
+# The generated sensor dumps have the same columns, 12-hour AM/PM 'Data' strings and -9999 sentinels as
+# "Dati_sensori_aria"; the station list has the columns the analysis uses from "Stazioni qualità dell'aria".
+#
+#   python benchmark.py --scales 1 10 --stations 3 41 91 --output bench.json
+
+# sensors and days of synthetic data at scale 1 (about half a million hourly rows)
+BASE_SENSORS = 60
+BASE_DAYS = 365
+
+
+# Function to generate a synthetic station list: the Milan sensors plus `n_sensors` regional ones
+def generate_station_data(n_sensors, seed=0):
+    rng = np.random.default_rng(seed)
+    milan = list(MILAN_PM25_STATIONS) + list(MILAN_PM10_STATIONS)
+    regional = list(range(30000, 30000 + max(n_sensors - len(milan), 0)))
+    sensor_ids = milan + regional
+    sensor_types = ([SENSOR_TYPES['pm25']] * len(MILAN_PM25_STATIONS) + [SENSOR_TYPES['pm10']] * len(MILAN_PM10_STATIONS)
+                    + list(rng.choice(list(SENSOR_TYPES.values()), len(regional))))
+    provinces = ['MI'] * len(milan) + list(rng.choice(['MI', 'BG', 'BS', 'CO', 'VA', 'PV'], len(regional)))
+    return pd.DataFrame({
+        'IdSensore': sensor_ids,
+        'NomeTipoSensore': sensor_types,
+        'UnitaMisura': 'µg/m³',
+        'Idstazione': np.arange(len(sensor_ids)) // 3 + 500,
+        'NomeStazione': [f'Stazione {i // 3}' for i in range(len(sensor_ids))],
+        'Provincia': provinces,
+        'Comune': ['Milano' if p == 'MI' else f'Comune {p}' for p in provinces],
+        'lat': 45.0 + rng.random(len(sensor_ids)) * 1.5,
+        'lng': 8.6 + rng.random(len(sensor_ids)) * 2.5,
+    })
+
+# Function to generate a synthetic ARPA sensor dump with hourly readings for every sensor
+#   missing_rate: share of readings set to the -9999 sentinel; invalid_rate: share flagged 'NA' in 'Stato'
+def generate_sensor_data(sensor_ids, n_days, start_date='2023-01-01', missing_rate=0.03, invalid_rate=0.05, seed=0):
+    rng = np.random.default_rng(seed)
+    sensor_ids = np.asarray(sensor_ids)
+    hours = pd.date_range(start_date, periods=n_days * 24, freq='h')
+    # format every distinct timestamp once and repeat the strings for all sensors
+    hour_strings = np.asarray(hours.strftime(DATE_FORMAT), dtype=object)
+    hour_index = np.tile(np.arange(len(hours)), len(sensor_ids))
+    # a seasonal cycle (higher in winter) plus noise, rounded like the ARPA values
+    season = 1.0 + 0.6 * np.cos(2 * np.pi * hours.dayofyear.to_numpy() / 365.25)
+    values = np.round(rng.gamma(2.0, 10.0, len(hour_index)) * season[hour_index], 1)
+    values[rng.random(len(values)) < missing_rate] = -9999.0
+    data = pd.DataFrame({
+        'IdSensore': np.repeat(sensor_ids, len(hours)),
+        'Data': hour_strings[hour_index],
+        'Valore': values,
+        'Stato': np.where(rng.random(len(values)) < invalid_rate, 'NA', 'VA'),
+        'idOperatore': 1,
+    })
+    # the dumps are not sorted
+    return data.iloc[rng.permutation(len(data))].reset_index(drop=True)
+
+# Function to time a call (best of `repeat`) and measure its peak traced memory on one more call
+#   setup() builds fresh arguments for every call, outside of the measurement
+def measure(func, setup, repeat=3):
+    times = []
+    for _ in range(repeat):
+        args = setup()
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    args = setup()
+    tracemalloc.start()
+    try:
+        func(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'seconds': min(times), 'peak_mb': peak / 2**20}
+
+# Function to render one chart to an in-memory SVG and close it, for timing the plot functions
+def _render(plot_function, daily, start_date, end_date):
+    plot_function(daily, 'Benchmark', start_date, end_date, save=True, annotation=True)
+    plt.savefig(io.BytesIO(), format='svg', dpi=300, facecolor='w')
+    plt.close('all')
+
+# Function to run the notebook pipeline on two snapshots: aggregate, merge and render the charts
+def run_pipeline(old_data, data, map_data):
+    groups = station_groups(map_data)
+    daily, yearly = aggregate_station_groups(data, groups)
+    old_daily, old_yearly = aggregate_station_groups(old_data, groups)
+    # keep only the days and years the newer snapshot does not cover
+    old_daily = old_daily[old_daily['date'] < old_daily['group'].map(daily.groupby('group')['date'].min())]
+    old_yearly = old_yearly[~old_yearly.set_index(['group', 'year']).index.isin(yearly.set_index(['group', 'year']).index)]
+    daily = pd.concat([old_daily, daily], ignore_index=True)
+    yearly = pd.concat([old_yearly, yearly], ignore_index=True)
+    start_date, end_date = daily['date'].min(), daily['date'].max()
+    specs = [(pollutant, region, start_date, end_date, True) for pollutant, region in PLOT_FUNCTIONS]
+    with tempfile.TemporaryDirectory() as out_dir:
+        render_charts(daily, specs, out_dir, processes=1)
+    return daily, yearly
+
+# Function to run every benchmark at one scale and for several station counts
+def run_benchmarks(scale, station_counts=(3, 41, 91), repeat=3, seed=0):
+    n_sensors = int(BASE_SENSORS * scale)
+    map_data = generate_station_data(max(n_sensors, max(station_counts)), seed)
+    sensor_ids = map_data['IdSensore'].to_numpy()[:max(n_sensors, max(station_counts))]
+    data = generate_sensor_data(sensor_ids, BASE_DAYS, '2024-01-01', seed=seed)
+    old_data = generate_sensor_data(sensor_ids, BASE_DAYS, '2023-01-01', seed=seed + 1)
+    rows = len(data)
+
+    # fresh copies, so that timestamps parsed by one call are not reused by the next
+    def fresh():
+        return (data.copy(),)
+
+    benchmarks = [
+        ('pm25_sensors_avg', None, pm25_sensors_avg, fresh),
+        ('pm25_sensors_yearly_avg', None, pm25_sensors_yearly_avg, fresh),
+        ('pm10_sensors_avg', None, pm10_sensors_avg, fresh),
+        ('compact_observations', None, compact_observations, fresh),
+        ('aggregate_station_groups', None, aggregate_station_groups, lambda: (data.copy(), station_groups(map_data))),
+    ]
+    for count in station_counts:
+        stations = list(sensor_ids[:count])
+        benchmarks += [
+            ('calculate_sensor_avg', count, calculate_sensor_avg, lambda s=stations: (data.copy(), s)),
+            ('calculate_sensor_yearly_avg', count, calculate_sensor_yearly_avg, lambda s=stations: (data.copy(), s)),
+        ]
+
+    # the plot functions get the daily means they are given in the notebook (both snapshots)
+    daily = calculate_sensor_avg(pd.concat([old_data, data], ignore_index=True), list(sensor_ids))
+    start_date, end_date = daily['date'].min(), daily['date'].max()
+    for (pollutant, region), plot_function in PLOT_FUNCTIONS.items():
+        benchmarks.append((plot_function.__name__, None, _render,
+                           lambda f=plot_function: (f, daily.copy(), start_date, end_date)))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'Dati_sensori_aria.csv')
+        data.to_csv(path, index=False)
+        benchmarks += [
+            ('read_csv', None, pd.read_csv, lambda: (path,)),
+            ('load_sensor_data', len(MILAN_PM25_STATIONS), load_sensor_data, lambda: (path, list(MILAN_PM25_STATIONS))),
+        ]
+        benchmarks.append(('pipeline', None, run_pipeline, lambda: (old_data.copy(), data.copy(), map_data)))
+
+        results = []
+        for name, count, func, setup in benchmarks:
+            result = {'benchmark': name, 'scale': scale, 'rows': rows, 'n_stations': count}
+            try:
+                result.update(measure(func, setup, repeat))
+            except Exception as e:
+                # keep going so one broken benchmark does not hide the others
+                result['error'] = f'{type(e).__name__}: {e}'
+            results.append(result)
+            print(json.dumps(result), file=sys.stderr)
+    return results
+
+# Function to describe the environment the benchmarks ran in
+def environment():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'matplotlib': matplotlib.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'time': pd.Timestamp.now().isoformat(timespec='seconds'),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark functions.py on synthetic ARPA data.')
+    parser.add_argument('--scales', type=float, nargs='+', default=[1, 10],
+                        help=f'data sizes as multiples of {BASE_SENSORS} sensors x {BASE_DAYS} days')
+    parser.add_argument('--stations', type=int, nargs='+', default=[3, 41, 91],
+                        help='station counts for calculate_sensor_avg / calculate_sensor_yearly_avg')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per benchmark (the best is kept)')
+    parser.add_argument('--output', default='-', help='JSON file to write, - for stdout')
+    args = parser.parse_args(argv)
+
+    report = {'environment': environment(), 'results': []}
+    for scale in args.scales:
+        report['results'] += run_benchmarks(scale, args.stations, args.repeat)
+
+    if args.output == '-':
+        json.dump(report, sys.stdout, indent=1)
+        print()
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+
+if __name__ == '__main__':
+    main()
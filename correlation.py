@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+
+from functions import sensor_time_matrix
+from rolling import daily_mean_matrix
+
+# Station-to-station correlation, lagged correlation and difference matrices for all sensors at once.
+# Every pairwise statistic is built from a handful of pairwise moments over the times both sensors have a
+# valid reading (n, sums, sums of squares, sums of products), and each moment is one matrix product of the
+# sensor x time matrix with NaNs zeroed and its 0/1 validity mask, so -9999 gaps are excluded pair by pair
+# (like DataFrame.corr) without any loop over pairs. The moments are additive over time, which is what
+# CorrelationAccumulator uses to update the matrices as new days arrive.
+
+
+# Function to compute the pairwise moments of the rows of a and b over the columns where both are valid
+#   returns n, sum of a, sum of b, sum of a², sum of b², sum of a*b (each rows of a x rows of b)
+def pairwise_moments(a, b):
+    valid_a, valid_b = ~np.isnan(a), ~np.isnan(b)
+    a0, b0 = np.where(valid_a, a, 0.0), np.where(valid_b, b, 0.0)
+    mask_a, mask_b = valid_a.astype('float64'), valid_b.astype('float64')
+    return {
+        'n': mask_a @ mask_b.T,
+        'sum_a': a0 @ mask_b.T,
+        'sum_b': mask_a @ b0.T,
+        'sum_aa': (a0 * a0) @ mask_b.T,
+        'sum_bb': mask_a @ (b0 * b0).T,
+        'sum_ab': a0 @ b0.T,
+    }
+
+# Function to add two sets of pairwise moments
+def _add_moments(left, right):
+    return {name: left[name] + right[name] for name in left}
+
+# Function to turn pairwise moments into Pearson correlations (NaN below min_periods common values)
+def moments_correlation(moments, min_periods=2):
+    n = moments['n']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        covariance = moments['sum_ab'] - moments['sum_a'] * moments['sum_b'] / n
+        variance_a = moments['sum_aa'] - moments['sum_a'] ** 2 / n
+        variance_b = moments['sum_bb'] - moments['sum_b'] ** 2 / n
+        correlation = covariance / np.sqrt(variance_a * variance_b)
+    correlation[n < max(min_periods, 2)] = np.nan
+    return np.clip(correlation, -1.0, 1.0)
+
+# Function to turn pairwise moments into the mean and root-mean-square of the differences a - b
+def moments_differences(moments, min_periods=1):
+    n = moments['n']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = (moments['sum_a'] - moments['sum_b']) / n
+        rms = np.sqrt(np.maximum(moments['sum_aa'] + moments['sum_bb'] - 2 * moments['sum_ab'], 0.0) / n)
+    mean[n < max(min_periods, 1)] = np.nan
+    rms[n < max(min_periods, 1)] = np.nan
+    return mean, rms
+
+# Function to compute the moments between every row at time t and every row at time t + lag
+def lagged_moments(matrix, lag):
+    if lag == 0:
+        return pairwise_moments(matrix, matrix)
+    return pairwise_moments(matrix[:, :-lag], matrix[:, lag:])
+
+
+# Pairwise moments of a fixed set of sensors, updated one block of new columns (days or hours) at a time;
+# the last max(lags) columns are kept so that lagged pairs spanning two blocks are counted
+class CorrelationAccumulator:
+    def __init__(self, sensor_ids, lags=()):
+        self.sensor_ids = np.asarray(sensor_ids)
+        self.lags = [lag for lag in lags if lag > 0]
+        self.moments = None
+        self.lag_moments = {lag: None for lag in self.lags}
+        self._tail = np.zeros((len(self.sensor_ids), 0))
+
+    # Function to add new columns (rows in the order of sensor_ids, NaN where missing)
+    def update(self, block):
+        block = np.asarray(block, dtype='float64')
+        moments = pairwise_moments(block, block)
+        self.moments = moments if self.moments is None else _add_moments(self.moments, moments)
+        extended = np.concatenate([self._tail, block], axis=1)
+        kept, end = self._tail.shape[1], extended.shape[1]
+        for lag in self.lags:
+            # pairs (t, t + lag) whose later column is new
+            start = max(kept, lag)
+            if start >= end:
+                continue
+            moments = pairwise_moments(extended[:, start - lag:end - lag], extended[:, start:end])
+            previous = self.lag_moments[lag]
+            self.lag_moments[lag] = moments if previous is None else _add_moments(previous, moments)
+        if self.lags:
+            self._tail = extended[:, -max(self.lags):]
+        return self
+
+    # Function to get the current matrices as DataFrames indexed by sensor ID on both axes
+    def matrices(self, min_periods=2):
+        def frame(values):
+            return pd.DataFrame(values, index=self.sensor_ids, columns=self.sensor_ids)
+
+        mean, rms = moments_differences(self.moments, min_periods)
+        result = {
+            'n': frame(self.moments['n'].astype('int64')),
+            'correlation': frame(moments_correlation(self.moments, min_periods)),
+            'mean_difference': frame(mean),
+            'rms_difference': frame(rms),
+        }
+        for lag, moments in self.lag_moments.items():
+            if moments is not None:
+                result[f'correlation_lag_{lag}'] = frame(moments_correlation(moments, min_periods))
+        return result
+
+
+# Function to compute the correlation, lagged correlation and difference matrices between sensors
+#   freq: 'D' compares daily means, 'h' the hourly readings
+#   lags: in steps of freq; 'correlation_lag_<k>'[i, j] correlates sensor i with sensor j k steps later
+#   returns a dict of sensor x sensor DataFrames ('n' is the number of common valid steps)
+def sensor_correlations(data, sensors=None, start_date=None, end_date=None, freq='D', lags=(1,), min_periods=30):
+    if freq == 'D':
+        matrix, sensor_ids, _ = daily_mean_matrix(data, sensors, start_date, end_date)
+    else:
+        matrix, sensor_ids, _ = sensor_time_matrix(data, sensors, freq, start_date, end_date)
+    return CorrelationAccumulator(sensor_ids, lags).update(matrix).matrices(min_periods)
+
+# Function to list sensor pairs by correlation, with a redundancy flag, and each sensor's
+# median correlation with the others (low values point at outlier stations)
+#   returns (pairs frame sorted by correlation, per-sensor frame sorted by median correlation)
+def station_redundancy(matrices, threshold=0.95):
+    correlation = matrices['correlation']
+    sensor_ids = correlation.index.to_numpy()
+    upper = np.triu_indices(len(sensor_ids), k=1)
+    pairs = pd.DataFrame({
+        'sensor_a': sensor_ids[upper[0]],
+        'sensor_b': sensor_ids[upper[1]],
+        'correlation': correlation.to_numpy()[upper],
+        'mean_difference': matrices['mean_difference'].to_numpy()[upper],
+        'n': matrices['n'].to_numpy()[upper],
+    }).dropna(subset=['correlation'])
+    pairs['redundant'] = pairs['correlation'] >= threshold
+    values = correlation.to_numpy().copy()
+    np.fill_diagonal(values, np.nan)
+    sensors = pd.DataFrame({'IdSensore': sensor_ids, 'median_correlation': pd.DataFrame(values).median(axis=1).to_numpy()})
+    return (pairs.sort_values('correlation', ascending=False).reset_index(drop=True),
+            sensors.sort_values('median_correlation').reset_index(drop=True))
@@ -0,0 +1,127 @@
+import os
+import json
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from functions import sensor_day_matrices
+
+# Dense sensor x day cube of prefix sums for constant-time range queries.
+# Every array has one row per sensor and one column per day plus a leading column of zeros, holding the
+# cumulative sum up to (not including) that day, so any date range is the difference of two columns:
+#   sum        - sum of the valid hourly readings
+#   count      - number of valid hourly readings
+#   days_valid - number of days with at least one valid reading
+#   mean       - sum of the daily means
+#   above_<t>  - number of days whose daily mean is above threshold t
+
+
+# Function to build the cube from per-sensor daily sums and counts (sensor_daily_sums or the
+# observation store's daily table), precomputing exceedance counts for the given thresholds
+def build_daily_cube(sums, thresholds=(), sensors=None, start_date=None, end_date=None):
+    sum_matrix, count_matrix, sensor_ids, days = sensor_day_matrices(sums, sensors, start_date, end_date)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        daily_means = sum_matrix / count_matrix
+    valid_days = count_matrix > 0
+
+    def prefix(matrix, dtype='int64'):
+        out = np.zeros((matrix.shape[0], matrix.shape[1] + 1), dtype=dtype)
+        np.cumsum(matrix, axis=1, out=out[:, 1:])
+        return out
+
+    cube = {
+        'sensor_ids': sensor_ids.astype('int64'),
+        'days': days.to_numpy().astype('datetime64[D]'),
+        'sum': prefix(sum_matrix, 'float64'),
+        'count': prefix(count_matrix),
+        'days_valid': prefix(valid_days),
+        'mean': prefix(np.where(valid_days, daily_means, 0.0), 'float64'),
+    }
+    for threshold in thresholds:
+        cube[f'above_{threshold:g}'] = prefix(valid_days & (np.where(valid_days, daily_means, 0.0) > threshold))
+    return cube
+
+# Function to write a cube as one .npy file per array
+def save_cube(cube, directory):
+    tmp_directory = directory + '.tmp'
+    shutil.rmtree(tmp_directory, ignore_errors=True)
+    os.makedirs(tmp_directory)
+    for name, values in cube.items():
+        np.save(os.path.join(tmp_directory, f'{name}.npy'), values)
+    with open(os.path.join(tmp_directory, 'arrays.json'), 'w') as f:
+        json.dump(list(cube), f)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.rename(tmp_directory, directory)
+
+# Function to read a cube written by save_cube, memory-mapping the arrays
+def load_cube(directory, mmap=True):
+    with open(os.path.join(directory, 'arrays.json')) as f:
+        names = json.load(f)
+    mmap_mode = 'r' if mmap else None
+    return {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode) for name in names}
+
+# Function to find the cube rows of some sensors and the prefix columns bounding a date range (inclusive)
+def _locate(cube, sensors, start_date, end_date):
+    sensor_ids = cube['sensor_ids']
+    sensors = np.asarray(list(sensors), dtype='int64')
+    rows = np.searchsorted(sensor_ids, sensors)
+    rows = rows[(rows < len(sensor_ids)) & (sensor_ids[np.minimum(rows, len(sensor_ids) - 1)] == sensors)]
+    days = cube['days']
+    start = np.searchsorted(days, np.datetime64(pd.Timestamp(start_date).date(), 'D'), side='left')
+    end = np.searchsorted(days, np.datetime64(pd.Timestamp(end_date).date(), 'D'), side='right')
+    return rows, start, max(start, end)
+
+# Function to recover the daily sums and counts of some sensors over a date range from the prefix sums
+def _daily_arrays(cube, rows, start, end):
+    sums = np.diff(np.asarray(cube['sum'][rows, start:end + 1]), axis=1)
+    counts = np.diff(np.asarray(cube['count'][rows, start:end + 1]), axis=1)
+    return sums, counts
+
+# Function to get the daily means of a group of stations over a date range (all readings pooled per day)
+def group_daily_means(cube, sensors, start_date, end_date):
+    rows, start, end = _locate(cube, sensors, start_date, end_date)
+    sums, counts = _daily_arrays(cube, rows, start, end)
+    total = counts.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums.sum(axis=0) / total
+    return pd.DataFrame({'date': pd.to_datetime(cube['days'][start:end]).date, 'Valore': means})
+
+# Function to answer a range query for a set of sensors from the cube
+#   stat='mean': mean of all valid readings of the sensors in the range
+#   stat='daily_mean': mean of the sensors' daily means over their valid days in the range
+#   stat='days_above': days above `threshold`, counted per sensor and summed (constant time when the
+#       threshold was precomputed in build_daily_cube); with group=True, days on which the group's
+#       pooled daily mean is above the threshold
+#   stat='valid_days': days with at least one valid reading, summed over the sensors
+#   per_sensor=True returns one value per sensor (in the order of the cube's sensor_ids) instead of a total
+def query_cube(cube, sensors, start_date, end_date, stat='mean', threshold=None, per_sensor=False, group=False):
+    rows, start, end = _locate(cube, sensors, start_date, end_date)
+
+    def range_sum(name):
+        values = np.asarray(cube[name][rows, end]) - np.asarray(cube[name][rows, start])
+        return values if per_sensor else values.sum()
+
+    if stat == 'mean':
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return range_sum('sum') / range_sum('count')
+    if stat == 'daily_mean':
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return range_sum('mean') / range_sum('days_valid')
+    if stat == 'valid_days':
+        return range_sum('days_valid')
+    if stat == 'days_above':
+        if threshold is None:
+            raise ValueError("stat='days_above' needs a threshold")
+        if group:
+            means = group_daily_means(cube, cube['sensor_ids'][rows], start_date, end_date)['Valore']
+            return int((means > threshold).sum())
+        name = f'above_{threshold:g}'
+        if name in cube:
+            return range_sum(name)
+        # threshold not precomputed: fall back to the daily means in the range
+        sums, counts = _daily_arrays(cube, rows, start, end)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            above = (sums / counts > threshold).sum(axis=1)
+        return above if per_sensor else above.sum()
+    raise ValueError(f'unknown stat: {stat}')
@@ -1,194 +1,950 @@
+import os
+import json
+import shutil
+import hashlib
+import importlib.util
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 
+from profiling import profiled, stage, carry_stage
+
+# timestamp format used in the 'Data' column of the ARPA sensor dumps
+DATE_FORMAT = '%d/%m/%Y %I:%M:%S %p'
+
+# columns needed from the ARPA "Dati_sensori_aria" dumps and the dtypes to read them with
+SENSOR_COLUMNS = ['IdSensore', 'Data', 'Valore', 'Stato']
+SENSOR_DTYPES = {'IdSensore': 'int32', 'Data': 'object', 'Valore': 'float64', 'Stato': 'object'}
+
+# Function to parse ARPA 'Data' strings, parsing each distinct string only once
+@profiled
+def parse_dates(values):
+    values = pd.Series(values)
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes, uniques = values.cat.codes.to_numpy(), values.cat.categories
+    else:
+        codes, uniques = pd.factorize(values)
+    # hourly data repeats the same few thousand timestamps for every sensor
+    parsed = pd.to_datetime(pd.Index(uniques), format=DATE_FORMAT)
+    # map back onto all rows (code -1 means missing and becomes NaT)
+    return pd.Series(parsed.take(codes, allow_fill=True, fill_value=pd.NaT), index=values.index)
+
+# Function to add the shared parsed 'timestamp' column to a sensor frame (once, in place)
+@profiled
+def add_timestamps(data):
+    if 'timestamp' not in data.columns:
+        data['timestamp'] = parse_dates(data['Data'])
+    return data
+
+# Function to turn timestamps into datetime.date values, converting each distinct day once
+def timestamps_to_dates(timestamps):
+    codes, days = pd.factorize(timestamps.dt.normalize())
+    dates = pd.DatetimeIndex(days).date[codes]
+    # code -1 means missing: None, as .dt.date gives for NaT (and groupby drops)
+    dates[codes == -1] = None
+    return pd.Series(dates, index=timestamps.index)
+
+# Function to read the columns needed from an ARPA sensor dump (extra arguments go to pd.read_csv,
+# e.g. chunksize or engine)
+#   required: fail if one of SENSOR_COLUMNS is missing, otherwise read the ones present
+def read_sensor_csv(path, required=True, **kwargs):
+    usecols = SENSOR_COLUMNS if required else (lambda col: col in SENSOR_COLUMNS)
+    # keep_default_na=False so that the 'NA' validity flag in 'Stato' is not read as missing
+    return pd.read_csv(path, usecols=usecols, dtype=SENSOR_DTYPES, keep_default_na=False,
+                       na_values=[''], **kwargs)
+
+# Function to load an ARPA sensor dump in chunks, keeping only the given sensors and dates
+@profiled
+def load_sensor_data(path, sensors=None, start_date=None, end_date=None, chunksize=1_000_000):
+    if sensors is not None:
+        sensors = np.unique(np.asarray(list(sensors), dtype='int32'))
+    if start_date is not None:
+        start_date = pd.to_datetime(start_date)
+    if end_date is not None:
+        # include the whole end day
+        end_date = pd.to_datetime(end_date) + pd.Timedelta(days=1)
+
+    chunks = []
+    reader = read_sensor_csv(path, chunksize=chunksize)
+    for chunk in reader:
+        # drop sensors we don't need before touching the dates
+        if sensors is not None:
+            chunk = chunk[np.isin(chunk['IdSensore'].to_numpy(), sensors)]
+        # parse dates only for the rows left, and only if a date range was requested
+        if len(chunk) and (start_date is not None or end_date is not None):
+            dates = parse_dates(chunk['Data'])
+            keep = np.ones(len(chunk), dtype=bool)
+            if start_date is not None:
+                keep &= (dates >= start_date).to_numpy()
+            if end_date is not None:
+                keep &= (dates < end_date).to_numpy()
+            chunk = chunk[keep]
+        chunks.append(chunk)
+
+    if not chunks:
+        return pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in SENSOR_DTYPES.items()})
+    data = pd.concat(chunks, ignore_index=True)
+    # validity flags only take a couple of values
+    data['Stato'] = data['Stato'].astype('category')
+    return data
+
+# Function to read one snapshot for load_snapshots, with parsed timestamps
+def _read_snapshot(path, sensors=None, start_date=None, end_date=None, engine='c'):
+    if engine == 'pyarrow' and sensors is None and start_date is None and end_date is None:
+        # the pyarrow parser is multi-threaded but reads the whole file at once, so it is only
+        # used when the whole file is wanted anyway
+        data = read_sensor_csv(path, engine='pyarrow')
+        data['Stato'] = data['Stato'].astype('category')
+    else:
+        # filtered reads go chunk by chunk, dropping unwanted rows as they are read
+        data = load_sensor_data(path, sensors, start_date, end_date)
+    # the same few thousand timestamps repeat for every sensor, so keep them as categorical codes
+    data['Data'] = data['Data'].astype('category')
+    add_timestamps(data)
+    return data
+
+# Function to load several ARPA snapshots concurrently and reconcile them into one dataset
+#   paths: snapshots, oldest first; where they overlap, the reading of the newest snapshot wins
+#   engine: 'pyarrow' (multi-threaded) when installed, otherwise the 'c' parser, one thread per file;
+#       reads filtered by sensors or dates always use the chunked 'c' parser
+@profiled
+def load_snapshots(paths, sensors=None, start_date=None, end_date=None, threads=None, engine=None):
+    if not paths:
+        raise ValueError('load_snapshots needs at least one snapshot path')
+    if engine is None:
+        engine = 'pyarrow' if importlib.util.find_spec('pyarrow') is not None else 'c'
+    with ThreadPoolExecutor(max_workers=threads or min(len(paths), os.cpu_count() or 1) or 1) as pool:
+        snapshots = list(pool.map(carry_stage(lambda path: _read_snapshot(path, sensors, start_date, end_date, engine)), paths))
+    with stage('reconcile', sum(len(snapshot) for snapshot in snapshots)) as record:
+        # concatenated in path order, so keeping the last copy of a reading keeps the newest one
+        data = pd.concat(snapshots, ignore_index=True)
+        for col in ['Data', 'Stato']:
+            data[col] = data[col].astype('category')
+        data = deduplicate_observations(data).reset_index(drop=True)
+        record['rows_out'] = len(data)
+    return data
+
+# 'Stato' values of readings that count as valid
+VALID_STATES = ('VA',)
+# share of a sensor's expected daily readings that must be valid for a valid daily mean
+# (75%: 18 of 24 for hourly sensors, the one reading for sensors reporting daily values)
+MIN_DAY_COMPLETENESS = 0.75
+
+# Function to flag the readings that pass QA: not the -9999.0 sentinel and flagged valid in 'Stato'
+def valid_readings(data, valid_states=VALID_STATES):
+    valid = (data['Valore'] != -9999.0).to_numpy() & data['Valore'].notna().to_numpy()
+    if 'Stato' in data.columns:
+        valid &= data['Stato'].isin(valid_states).to_numpy()
+    if 'timestamp' in data.columns:
+        valid &= data['timestamp'].notna().to_numpy()
+    return valid
+
+# Function to estimate the readings per day of every sensor from the median spacing of its timestamps
+#   returns a Series indexed by IdSensore (24 for hourly sensors, 1 for daily ones)
+def readings_per_day(data):
+    timestamps = data[['IdSensore', 'timestamp']].dropna().drop_duplicates().sort_values(['IdSensore', 'timestamp'])
+    spacing = timestamps.groupby('IdSensore')['timestamp'].diff().dt.total_seconds()
+    spacing = spacing.groupby(timestamps['IdSensore'].to_numpy()).median()
+    # sensors with a single reading count as daily
+    expected = (86_400 / spacing).round().clip(lower=1).fillna(1).astype('int64')
+    return expected.reindex(pd.unique(data['IdSensore']), fill_value=1)
+
+# Function to flag the readings of sensor-days with at least min_completeness of the sensor's expected
+# daily readings valid ('valid' column)
+#   expected: readings per day of every sensor (readings_per_day), estimated from data if not given;
+#       pass it when data holds only a few days of each sensor
+def complete_days(data, min_completeness=MIN_DAY_COMPLETENESS, expected=None):
+    valid = data['valid'].to_numpy(dtype=bool)
+    # one integer key per (sensor, day), then valid readings per key with a single bincount
+    timestamps = data['timestamp']
+    days = timestamps.to_numpy().astype('datetime64[D]').astype('int64')
+    dated = timestamps.notna().to_numpy()
+    days = np.where(dated, days - days[dated].min(), 0) if dated.any() else np.zeros(len(data), dtype='int64')
+    keys = data['IdSensore'].to_numpy().astype('int64') * (int(days.max(initial=0)) + 1) + days
+    codes, uniques = pd.factorize(keys)
+    counts = np.bincount(codes, weights=valid, minlength=len(uniques))
+    # readings needed per row, from its sensor's cadence
+    if expected is None:
+        expected = readings_per_day(data)
+    expected = expected.reindex(data['IdSensore'].to_numpy(), fill_value=1).to_numpy()
+    return counts[codes] >= np.ceil(min_completeness * expected - 1e-9)
+
+# Function to run the quality checks once: recode -9999.0 to NA and add the 'valid' (reading passes QA) and
+# 'day_complete' (its sensor-day has at least min_completeness of the sensor's expected readings valid)
+# columns used by the aggregations
+#   drop: remove the readings failing either check instead of tagging them
+@profiled
+def quality_check(data, valid_states=VALID_STATES, min_completeness=MIN_DAY_COMPLETENESS, drop=False):
+    add_timestamps(data)
+    with stage('valid', len(data)):
+        data['valid'] = valid_readings(data, valid_states)
+    # recode -9999.0 to NA
+    data['Valore'] = data['Valore'].where(data['Valore'] != -9999.0)
+    with stage('day_complete', len(data)):
+        data['day_complete'] = complete_days(data, min_completeness)
+    if drop:
+        data = data[data['valid'].to_numpy() & data['day_complete'].to_numpy()].reset_index(drop=True)
+    return data
+
+# Function to get the readings to aggregate, optionally only the rows selected by mask:
+# the quality_check flags when the frame has them, otherwise just -9999.0 recoded to NA
+#   days: also mask the readings of incomplete days (daily and yearly means)
+def valid_values(data, mask=None, days=True):
+    values = data['Valore'] if mask is None else data['Valore'][mask]
+    # aggregate in float64 whatever the storage dtype (compact_observations keeps float32)
+    if values.dtype != 'float64':
+        values = values.astype('float64')
+    if 'valid' not in data.columns:
+        # recode -9999.0 to NA
+        return values.where(values != -9999.0)
+    keep = data['valid']
+    if days and 'day_complete' in data.columns:
+        keep = keep & data['day_complete']
+    return values.where(keep if mask is None else keep[mask])
+
+
+# default location of the on-disk cache of parsed snapshots
+CACHE_DIR = './data/cache'
+# bump when the layout of cached snapshots changes, so old entries are rebuilt
+CACHE_VERSION = 3
+
+# Function to compute the sha256 of a file without reading it into memory at once
+def file_hash(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Function to write a DataFrame as one .npy file per column (text columns stored as categorical codes)
+def save_frame(frame, directory):
+    tmp_directory = directory + '.tmp'
+    shutil.rmtree(tmp_directory, ignore_errors=True)
+    os.makedirs(tmp_directory)
+    columns = []
+    for i, name in enumerate(frame.columns):
+        column = frame[name]
+        if isinstance(column.dtype, pd.CategoricalDtype) or not (
+                pd.api.types.is_numeric_dtype(column) or pd.api.types.is_datetime64_dtype(column)):
+            column = column.astype('category')
+            np.save(os.path.join(tmp_directory, f'{i}.npy'), column.cat.codes.to_numpy())
+            np.save(os.path.join(tmp_directory, f'{i}.categories.npy'),
+                    column.cat.categories.astype(str).to_numpy(dtype=str))
+            columns.append({'name': name, 'kind': 'category'})
+        else:
+            np.save(os.path.join(tmp_directory, f'{i}.npy'), column.to_numpy())
+            columns.append({'name': name, 'kind': 'array'})
+    with open(os.path.join(tmp_directory, 'columns.json'), 'w') as f:
+        json.dump(columns, f)
+    # swap the finished directory in so readers never see a half-written frame
+    shutil.rmtree(directory, ignore_errors=True)
+    os.rename(tmp_directory, directory)
+
+# Function to read a DataFrame written by save_frame, memory-mapping the column files
+def load_frame(directory, mmap=True):
+    with open(os.path.join(directory, 'columns.json')) as f:
+        columns = json.load(f)
+    mmap_mode = 'r' if mmap else None
+    frame = {}
+    for i, column in enumerate(columns):
+        values = np.load(os.path.join(directory, f'{i}.npy'), mmap_mode=mmap_mode)
+        if column['kind'] == 'category':
+            categories = np.load(os.path.join(directory, f'{i}.categories.npy'))
+            values = pd.Categorical.from_codes(values, categories)
+        frame[column['name']] = values
+    return pd.DataFrame(frame, copy=False)
+
+# Function to return a parsed frame from the cache, building it with parse(path) on a miss
+#   variant: kept apart from the other cached forms of the same file
+def _cached_read(path, parse, cache_dir, variant=''):
+    stem = os.path.splitext(os.path.basename(path))[0] + variant
+    key = f'{stem}-v{CACHE_VERSION}-{file_hash(path)[:16]}'
+    directory = os.path.join(cache_dir, key)
+    if os.path.exists(os.path.join(directory, 'columns.json')):
+        return load_frame(directory)
+    frame = parse(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    # drop entries left over from earlier versions of the same file
+    for entry in os.listdir(cache_dir):
+        if entry.startswith(stem + '-v') and entry != key:
+            shutil.rmtree(os.path.join(cache_dir, entry), ignore_errors=True)
+    save_frame(frame, directory)
+    return load_frame(directory)
+
+# Function to parse an ARPA sensor dump into its cached form
+def _parse_sensor_snapshot(path, quality=True):
+    data = load_sensor_data(path)
+    # the same few thousand timestamps repeat for every sensor, so store them as categorical codes
+    data['Data'] = data['Data'].astype('category')
+    if not quality:
+        return data
+    # mask sentinels and invalid readings and flag incomplete days once, stored with the snapshot
+    return quality_check(data)
+
+# Function to load an ARPA sensor dump through the parsed snapshot cache
+#   quality: store the quality_check flags, so the means skip invalid readings and incomplete days;
+#       False gives the snapshot as load_sensor_data reads it (only -9999.0 is masked when aggregating)
+@profiled
+def load_sensor_data_cached(path, cache_dir=CACHE_DIR, quality=True):
+    if not quality:
+        return _cached_read(path, lambda path: _parse_sensor_snapshot(path, quality=False), cache_dir, '-raw')
+    return _cached_read(path, _parse_sensor_snapshot, cache_dir)
+
+# Function to load the ARPA station list through the parsed snapshot cache
+@profiled
+def load_station_data_cached(path, cache_dir=CACHE_DIR):
+    return _cached_read(path, pd.read_csv, cache_dir)
+
+# compact dtypes for sensor observations held in memory
+COMPACT_DTYPES = {'IdSensore': 'int32', 'Valore': 'float32', 'Stato': 'category', 'Stazione': 'category'}
+
+# Function to convert a sensor frame to the compact observation schema
+@profiled
+def compact_observations(data):
+    # parse 'Data' once, then drop the strings: 'timestamp' is stored as int64 datetimes
+    add_timestamps(data)
+    columns = [col for col in ['IdSensore', 'timestamp', 'Valore', 'Stato', 'Stazione', 'valid', 'day_complete']
+               if col in data.columns]
+    compact = data[columns]
+    # recode -9999.0 to NA before downcasting
+    compact = compact.assign(Valore=compact['Valore'].where(compact['Valore'] != -9999.0))
+    return compact.astype({col: dtype for col, dtype in COMPACT_DTYPES.items() if col in columns})
+
+# Function to report the memory used by each column of a frame
+def memory_usage_report(data):
+    usage = data.memory_usage(deep=True, index=True)
+    rows = max(len(data), 1)
+    report = pd.DataFrame({
+        'dtype': [str(data[col].dtype) if col in data.columns else '' for col in usage.index],
+        'MB': usage / 2**20,
+        'bytes_per_row': usage / rows,
+    })
+    report.loc['total'] = ['', usage.sum() / 2**20, usage.sum() / rows]
+    return report
+
 # subset to specific milan pm2.5 sensors
 # 17122 - Milano via Senato (PM2.5)
 # 20529 - Milano viale Marche (PM2.5)
 # 10283 - Milano Pascal Città Studi (PM2.5)
+MILAN_PM25_STATIONS = {17122: 'via Senato', 20529: 'viale Marche', 10283: 'Pascal Città Studi'}
+# Milan PM10 sensors, the last one is via Verziere
+MILAN_PM10_STATIONS = {10320: 'via Senato', 20429: 'viale Marche', 10273: 'Pascal Città Studi', 6956: 'Verziere'}
+
+# Function to map sensor IDs to names as a categorical, through an integer code lookup
+def map_categorical(values, mapping):
+    values = np.asarray(values)
+    keys = np.fromiter(mapping.keys(), dtype='int64', count=len(mapping))
+    categories = pd.Index(list(dict.fromkeys(mapping.values())))
+    key_codes = categories.get_indexer(list(mapping.values()))
+    order = np.argsort(keys)
+    keys, key_codes = keys[order], key_codes[order]
+    # binary search of every value in the sorted keys, unknown IDs get code -1 (missing)
+    position = np.clip(np.searchsorted(keys, values), 0, max(len(keys) - 1, 0))
+    found = (keys[position] == values) if len(keys) else np.zeros(len(values), dtype=bool)
+    codes = np.where(found, key_codes[position] if len(keys) else -1, -1)
+    return pd.Categorical.from_codes(codes, categories)
+
+# Function to subset a sensor frame to some stations and add 'date' and 'Stazione' columns
+@profiled
+def _station_subset(data, stations):
+    # parse 'Data' once on the full frame so later calls reuse it
+    add_timestamps(data)
+    # subset data to these stations (boolean indexing already returns a new frame)
+    with stage('subset', len(data)) as record:
+        pm_data = data[data['IdSensore'].isin(list(stations))]
+        record['rows_out'] = len(pm_data)
+    # Extract just the date part of the shared parsed timestamps
+    pm_data = pm_data.assign(date=timestamps_to_dates(pm_data['timestamp']))
+    # station names as a categorical column
+    with stage('station_names', len(pm_data)):
+        pm_data['Stazione'] = map_categorical(pm_data['IdSensore'].to_numpy(), stations)
+    # recode -9999.0 (and readings failing quality_check) to NA
+    pm_data['Valore'] = valid_values(pm_data)
+    return pm_data
 
 # Function to average the PM2.5 values at each station of 24 hours for each day
+@profiled
 def pm25_sensors_avg(data):
-    # list of PM2.5 stations
-    stations = [17122, 20529, 10283]
-    # subset data to these Milan stations
-    pm_data = data[data['IdSensore'].isin(stations)].copy()
-    # Convert the datetime_column to datetime datatype
-    pm_data['date'] = pd.to_datetime(pm_data['Data'], format='%d/%m/%Y %I:%M:%S %p', dayfirst=True)
-    # Extract just the date part
-    pm_data['date'] = pm_data['date'].dt.date.copy()
-    # make new empty column for station names
-    pm_data['Stazione'] = ''  # Create a new column with empty strings initially
-    # Define the conditions and corresponding values
-    conditions = [
-        (pm_data['IdSensore'] == 17122),
-        (pm_data['IdSensore'] == 20529),
-        (pm_data['IdSensore'] == 10283)
-    ]
-    values = ['via Senato', 'viale Marche', 'Pascal Città Studi']  # Corresponding values for each condition
-    # Apply the conditions and values using .loc
-    for condition, value in zip(conditions, values):
-        pm_data.loc[condition, 'Stazione'] = value
-    # recode -9999.0 to NA
-    pm_data['Valore'] = np.where(pm_data['Valore'] == -9999.0, np.nan, pm_data['Valore'])
+    pm_data = _station_subset(data, MILAN_PM25_STATIONS)
     # Calculate average for 'Valore' by each unique value of 'date'
-    mean_milan = pd.DataFrame(pm_data.groupby('date')['Valore'].mean())
-    # Reset index to convert the Series to a DataFrame
-    mean_milan = mean_milan.reset_index()
+    mean_milan = pm_data.groupby('date')['Valore'].mean().reset_index()
     # Rename columns if needed
     mean_milan.columns = ['date', 'Valore']
     return pm_data, mean_milan
 
+@profiled
 def pm25_sensors_yearly_avg(data):
-    # list of PM2.5 stations
-    stations = [17122, 20529, 10283]
-    # subset data to these Milan stations
-    pm_data = data[data['IdSensore'].isin(stations)].copy()
-    # Convert the datetime_column to datetime datatype
-    pm_data['date'] = pd.to_datetime(pm_data['Data'], format='%d/%m/%Y %I:%M:%S %p', dayfirst=True)
-    # Extract the year part
-    pm_data['year'] = pm_data['date'].dt.year
-    # make new empty column for station names
-    pm_data['Stazione'] = ''  
-    # Define the conditions and corresponding values
-    conditions = [
-        (pm_data['IdSensore'] == 17122),
-        (pm_data['IdSensore'] == 20529),
-        (pm_data['IdSensore'] == 10283)
-    ]
-    values = ['via Senato', 'viale Marche', 'Pascal Città Studi']
-    # Apply the conditions and values using .loc
-    for condition, value in zip(conditions, values):
-        pm_data.loc[condition, 'Stazione'] = value
-    # recode -9999.0 to NA
-    pm_data['Valore'] = np.where(pm_data['Valore'] == -9999.0, np.nan, pm_data['Valore'])
+    pm_data = _station_subset(data, MILAN_PM25_STATIONS)
+    # keep the full timestamps here and extract the year part
+    pm_data['date'] = pm_data['timestamp']
+    pm_data['year'] = pm_data['timestamp'].dt.year
     # Calculate yearly average for 'Valore'
     mean_milan = pm_data.groupby('year', as_index=False)['Valore'].mean()
     return pm_data, mean_milan
 
+@profiled
 def pm10_sensors_avg(data):
-    # PM10 sensors
-    stations_pm10 = [10320, 20429, 10273, 6956] # last one is via Verziere
-    # subset data to these Milan stations
-    pm10_data = data[data['IdSensore'].isin(stations_pm10)].copy()
-    # Convert the datetime_column to datetime datatype
-    pm10_data['date'] = pd.to_datetime(pm10_data['Data'], format='%d/%m/%Y %I:%M:%S %p', dayfirst=True)
-    # Extract just the date part
-    pm10_data['date'] = pm10_data['date'].dt.date.copy()
-    # make new empty column for station names
-    pm10_data['Stazione'] = ''  # Create a new column with empty strings initially
-    # Define the conditions and corresponding values
-    conditions = [
-        (pm10_data['IdSensore'] == 10320),
-        (pm10_data['IdSensore'] == 20429),
-        (pm10_data['IdSensore'] == 10273),
-        (pm10_data['IdSensore'] == 6956)
-    ]
-    values = ['via Senato', 'viale Marche', 'Pascal Città Studi', 'Verziere']  # Corresponding values for each condition
-    # Apply the conditions and values using .loc
-    for condition, value in zip(conditions, values):
-        pm10_data.loc[condition, 'Stazione'] = value
-    # recode -9999.0 to NA
-    pm10_data['Valore'] = np.where(pm10_data['Valore'] == -9999.0, np.nan, pm10_data['Valore'])
+    pm10_data = _station_subset(data, MILAN_PM10_STATIONS)
     # Calculate average for 'Valore' by each unique value of 'date'
-    mean_pm10_milan = pd.DataFrame(pm10_data.groupby('date')['Valore'].mean())
-    # Reset index to convert the Series to a DataFrame
-    mean_pm10_milan = mean_pm10_milan.reset_index()
+    mean_pm10_milan = pm10_data.groupby('date')['Valore'].mean().reset_index()
     # Rename columns if needed
     mean_pm10_milan.columns = ['date', 'Valore']
     return pm10_data, mean_pm10_milan
 
 
+@profiled
 def calculate_sensor_avg(data, pm_stations):
-    # subset to data in all Lombardia
-    pm_data = data[data['IdSensore'].isin(pm_stations)].copy()
-    # Convert the datetime_column to datetime datatype
-    pm_data['date'] = pd.to_datetime(pm_data['Data'], format='%d/%m/%Y %I:%M:%S %p', dayfirst=True)
-    # Extract just the date part
-    pm_data['date'] = pm_data['date'].dt.date.copy()
-    # recode -9999.0 to NA
-    pm_data['Valore'] = np.where(pm_data['Valore'] == -9999.0, np.nan, pm_data['Valore'])
-    # Calculate average for 'Valore' by each unique value of 'date'
-    mean_pm_data = pd.DataFrame(pm_data.groupby('date')['Valore'].mean())
-    # Reset index to convert the Series to a DataFrame
-    mean_pm_data = mean_pm_data.reset_index()
+    # parse 'Data' once on the full frame so later calls reuse it
+    add_timestamps(data)
+    # subset to data in all Lombardia, only the columns needed
+    with stage('subset', len(data)) as record:
+        mask = data['IdSensore'].isin(pm_stations)
+        timestamps = data['timestamp'][mask]
+        record['rows_out'] = len(timestamps)
+    # recode -9999.0 (and readings failing quality_check) to NA
+    values = valid_values(data, mask)
+    with stage('groupby', len(values)):
+        # Calculate average for 'Valore' for each day
+        mean_pm_data = values.groupby(timestamps.dt.normalize()).mean().reset_index()
     # Rename columns if needed
     mean_pm_data.columns = ['date', 'Valore']
+    # Extract just the date part
+    mean_pm_data['date'] = mean_pm_data['date'].dt.date
     return mean_pm_data
 
+@profiled
 def calculate_sensor_yearly_avg(data, pm_stations):
-    # Subset data for the specified PM2.5 stations
-    pm_data = data[data['IdSensore'].isin(pm_stations)].copy()
-    # Convert the datetime column to datetime datatype
-    pm_data['date'] = pd.to_datetime(pm_data['Data'], format='%d/%m/%Y %I:%M:%S %p', dayfirst=True)
-    # Extract the year
-    pm_data['year'] = pm_data['date'].dt.year
-    # Recode -9999.0 to NA
-    pm_data['Valore'] = np.where(pm_data['Valore'] == -9999.0, np.nan, pm_data['Valore'])
-    # Calculate yearly average for 'Valore'
-    mean_pm_data = pm_data.groupby('year', as_index=False)['Valore'].mean()
+    # parse 'Data' once on the full frame so later calls reuse it
+    add_timestamps(data)
+    # Subset data for the specified PM2.5 stations, only the columns needed
+    with stage('subset', len(data)) as record:
+        mask = data['IdSensore'].isin(pm_stations)
+        timestamps = data['timestamp'][mask]
+        record['rows_out'] = len(timestamps)
+    # Recode -9999.0 (and readings failing quality_check) to NA
+    values = valid_values(data, mask)
+    with stage('groupby', len(values)):
+        # Calculate yearly average for 'Valore'
+        mean_pm_data = values.groupby(timestamps.dt.year).mean().reset_index()
+    mean_pm_data.columns = ['year', 'Valore']
+    return mean_pm_data
+
+# Function to sum one shard of the raw columns by day: select the stations, mask the readings that
+# valid_values would, number the days and add up
+#   returns (first day number, readings per day, valid readings per day, sum of valid readings per day)
+def _day_sums(columns, pm_stations, start, end):
+    mask = np.isin(columns['IdSensore'][start:end], pm_stations)
+    times = columns['timestamp'][start:end][mask].view('datetime64[ns]')
+    values = columns['Valore'][start:end][mask]
+    # readings without a timestamp are left out, as by the groupby of calculate_sensor_avg
+    dated = ~np.isnat(times)
+    # recode -9999.0 (and readings failing quality_check) to NA
+    valid = dated & ~np.isnan(values) & (values != -9999.0)
+    for flag in ('valid', 'day_complete'):
+        if flag in columns:
+            valid &= columns[flag][start:end][mask]
+    day_numbers = times[dated].astype('datetime64[D]').astype('int64')
+    if not len(day_numbers):
+        return 0, np.zeros(0, dtype='int64'), np.zeros(0, dtype='int64'), np.zeros(0)
+    # day numbers from the shard's first day, so that partial sums are small arrays indexed by day
+    first_day = int(day_numbers.min())
+    day_numbers -= first_day
+    valid_days = times[valid].astype('datetime64[D]').astype('int64') - first_day
+    n_days = int(day_numbers.max()) + 1
+    return (first_day, np.bincount(day_numbers, minlength=n_days), np.bincount(valid_days, minlength=n_days),
+            np.bincount(valid_days, weights=values[valid], minlength=n_days))
+
+# Function to sum one shard of rows by day, reading the shared-memory columns written by _shared_day_sums
+def _shard_day_sums(layout, n_rows, pm_stations, start, end):
+    blocks = {name: shared_memory.SharedMemory(name=block) for name, block, _ in layout}
+    try:
+        columns = {name: np.ndarray((n_rows,), dtype=dtype, buffer=blocks[name].buf) for name, _, dtype in layout}
+        return _day_sums(columns, pm_stations, start, end)
+    finally:
+        for block in blocks.values():
+            block.close()
+
+# Function to pool the readings of some stations by day across a process pool
+#   the raw columns are copied to shared memory once; every worker selects, masks and sums its own
+#   shard of rows, and the per-day partial sums are merged here
+#   returns (days, readings per day, valid readings per day, sum of valid readings per day)
+def _shared_day_sums(data, pm_stations, processes=None, shards_per_process=4):
+    add_timestamps(data)
+    columns = {
+        'IdSensore': data['IdSensore'].to_numpy(dtype='int64'),
+        'timestamp': data['timestamp'].to_numpy().astype('datetime64[ns]', copy=False).view('int64'),
+        'Valore': data['Valore'].to_numpy(dtype='float64', na_value=np.nan),
+    }
+    for flag in ('valid', 'day_complete'):
+        if flag in data.columns:
+            columns[flag] = data[flag].to_numpy(dtype=bool)
+    pm_stations = np.asarray(list(pm_stations), dtype='int64')
+    n_rows = len(data)
+
+    processes = processes or os.cpu_count()
+    if processes == 1 or n_rows == 0:
+        partials = [_day_sums(columns, pm_stations, 0, n_rows)]
+    else:
+        blocks = {name: shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                  for name, array in columns.items()}
+        try:
+            for name, array in columns.items():
+                np.ndarray(array.shape, dtype=array.dtype, buffer=blocks[name].buf)[:] = array
+            layout = [(name, blocks[name].name, array.dtype.str) for name, array in columns.items()]
+            bounds = np.linspace(0, n_rows, processes * shards_per_process + 1).astype('int64')
+            with stage('shards', n_rows), ProcessPoolExecutor(max_workers=processes) as pool:
+                partials = list(pool.map(_shard_day_sums, *zip(*[(layout, n_rows, pm_stations, start, end)
+                                                                  for start, end in zip(bounds[:-1], bounds[1:])])))
+        finally:
+            for block in blocks.values():
+                block.close()
+                block.unlink()
+    # merge the partial sums of all shards on the days they cover
+    partials = [partial for partial in partials if len(partial[1])]
+    first_day = min((partial[0] for partial in partials), default=0)
+    n_days = max((partial[0] + len(partial[1]) for partial in partials), default=first_day) - first_day
+    rows, counts, sums = np.zeros(n_days, dtype='int64'), np.zeros(n_days, dtype='int64'), np.zeros(n_days)
+    for shard_first, shard_rows, shard_counts, shard_sums in partials:
+        offset = shard_first - first_day
+        rows[offset:offset + len(shard_rows)] += shard_rows
+        counts[offset:offset + len(shard_rows)] += shard_counts
+        sums[offset:offset + len(shard_rows)] += shard_sums
+    days = pd.to_datetime(np.arange(first_day, first_day + n_days).astype('datetime64[D]'))
+    return days, rows, counts, sums
+
+# Function to compute the daily means of calculate_sensor_avg with a process pool
+@profiled
+def parallel_sensor_avg(data, pm_stations, processes=None):
+    days, rows, counts, sums = _shared_day_sums(data, pm_stations, processes)
+    # days with readings (even only missing ones) appear, as in the groupby of calculate_sensor_avg
+    present = rows > 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(counts > 0, sums / counts, np.nan)
+    mean_pm_data = pd.DataFrame({'date': days[present].date, 'Valore': means[present]})
+    return mean_pm_data
+
+# Function to compute the yearly means of calculate_sensor_yearly_avg with a process pool
+@profiled
+def parallel_sensor_yearly_avg(data, pm_stations, processes=None):
+    days, rows, counts, sums = _shared_day_sums(data, pm_stations, processes)
+    # pool the daily partial sums by year
+    totals = pd.DataFrame({'rows': rows, 'count': counts, 'sum': sums}).groupby(days.year.rename('year')).sum()
+    totals = totals[totals['rows'] > 0]
+    mean_pm_data = pd.DataFrame({'year': totals.index.to_numpy().astype('int32'),
+                                 'Valore': (totals['sum'] / totals['count'].where(totals['count'] > 0)).to_numpy()})
     return mean_pm_data
 
-def plot_air_quality_25_milan(data, city, start_date, end_date, save=False, annotation=True):
+# Function to lay the readings of every sensor on a dense sensor x time matrix (NaN where missing)
+#   returns (matrix, sensor IDs of the rows, timestamps of the columns)
+@profiled
+def sensor_time_matrix(data, sensors=None, freq='h', start_date=None, end_date=None):
+    add_timestamps(data)
+    if sensors is not None:
+        data = data[data['IdSensore'].isin(sensors)]
+    sensor_ids = np.unique(data['IdSensore'].to_numpy()) if sensors is None else np.unique(np.asarray(list(sensors)))
+    timestamps = data['timestamp'].dt.floor(freq)
+    start = pd.Timestamp(start_date) if start_date is not None else timestamps.min()
+    end = pd.Timestamp(end_date) if end_date is not None else timestamps.max()
+    times = pd.date_range(start, end, freq=freq)
+    matrix = np.full((len(sensor_ids), len(times)), np.nan)
+    if len(times) == 0:
+        return matrix, sensor_ids, times
+    # integer row and column of every reading
+    rows = np.searchsorted(sensor_ids, data['IdSensore'].to_numpy())
+    cols = ((timestamps - times[0]) // pd.Timedelta(times.freq)).to_numpy()
+    keep = (cols >= 0) & (cols < len(times))
+    # recode -9999.0 (and readings failing quality_check) to NA
+    values = valid_values(data, days=False).to_numpy(dtype='float64')
+    matrix[rows[keep], cols[keep].astype('int64')] = values[keep]
+    return matrix, sensor_ids, times
+
+# Function to lay per-sensor daily sums and counts (from sensor_daily_sums) on dense sensor x day matrices
+#   returns (sums, counts, sensor IDs of the rows, days of the columns)
+@profiled
+def sensor_day_matrices(sums, sensors=None, start_date=None, end_date=None):
+    sensor_ids = np.unique(sums['IdSensore'].to_numpy()) if sensors is None else np.unique(np.asarray(list(sensors)))
+    days = pd.to_datetime(sums['date'])
+    start = pd.Timestamp(start_date) if start_date is not None else days.min()
+    end = pd.Timestamp(end_date) if end_date is not None else days.max()
+    day_index = pd.date_range(start, end, freq='D')
+    sum_matrix = np.zeros((len(sensor_ids), len(day_index)))
+    count_matrix = np.zeros((len(sensor_ids), len(day_index)), dtype='int32')
+    if len(day_index) == 0:
+        return sum_matrix, count_matrix, sensor_ids, day_index
+    rows = np.searchsorted(sensor_ids, sums['IdSensore'].to_numpy())
+    rows_valid = (rows < len(sensor_ids)) & (sensor_ids[np.minimum(rows, len(sensor_ids) - 1)] == sums['IdSensore'].to_numpy())
+    cols = ((days - day_index[0]) // pd.Timedelta(days=1)).to_numpy()
+    keep = rows_valid & (cols >= 0) & (cols < len(day_index))
+    sum_matrix[rows[keep], cols[keep]] = sums['sum'].to_numpy()[keep]
+    count_matrix[rows[keep], cols[keep]] = sums['count'].to_numpy()[keep]
+    return sum_matrix, count_matrix, sensor_ids, day_index
+
+# 'NomeTipoSensore' values in the ARPA station list for each pollutant
+SENSOR_TYPES = {
+    'pm25': 'Particelle sospese PM2.5',
+    'pm10': 'PM10 (SM2005)',
+    'no2': 'Biossido di Azoto',
+}
+
+# Indexed view of the ARPA station list ("Stazioni qualità dell'aria"): one row per sensor,
+# with lookups by sensor ID and precomputed sensor lists by pollutant, province and municipality
+class StationRegistry:
+    # columns the sensor lists are grouped by, and the keyword used for each in sensors()
+    GROUP_COLUMNS = {'pollutant': 'NomeTipoSensore', 'province': 'Provincia', 'municipality': 'Comune'}
+
+    def __init__(self, map_data):
+        self.stations = map_data.drop_duplicates('IdSensore').set_index('IdSensore', drop=False)
+        # row position of every sensor for constant-time lookups
+        self._positions = {sensor: i for i, sensor in enumerate(self.stations.index)}
+        # sorted sensor lists for every value and every pair of values of the grouping columns
+        self._groups = {}
+        columns = [col for col in self.GROUP_COLUMNS.values() if col in self.stations.columns]
+        for n, col in enumerate(columns):
+            for key_columns in [[col]] + [[col, other] for other in columns[n + 1:]]:
+                positions = self.stations.groupby(key_columns, sort=False).indices
+                for key, rows in positions.items():
+                    key = key if isinstance(key, tuple) else (key,)
+                    self._groups[tuple(zip(key_columns, key))] = np.sort(self.stations.index.to_numpy()[rows])
+        # station names keyed by sensor ID for the categorical mapping
+        name_column = 'NomeStazione' if 'NomeStazione' in self.stations.columns else 'IdSensore'
+        self._names = dict(zip(self.stations.index, self.stations[name_column]))
+
+    # Function to return the station list row of a sensor
+    def lookup(self, sensor):
+        return self.stations.iloc[self._positions[sensor]]
+
+    # Function to return the sensors matching a pollutant ('pm25', 'pm10', 'no2' or any NomeTipoSensore),
+    # province (e.g. 'MI') and/or municipality (e.g. 'Milano')
+    def sensors(self, pollutant=None, province=None, municipality=None):
+        pollutant = SENSOR_TYPES.get(pollutant, pollutant)
+        criteria = {'pollutant': pollutant, 'province': province, 'municipality': municipality}
+        key = tuple((self.GROUP_COLUMNS[name], value) for name, value in criteria.items() if value is not None)
+        if not key:
+            return self.stations.index.to_numpy()
+        if len(key) <= 2:
+            return self._groups.get(key, np.array([], dtype='int64'))
+        # all three criteria: intersect two precomputed lists
+        return np.intersect1d(self._groups.get(key[:2], []), self._groups.get(key[2:], []), assume_unique=True)
+
+    # Function to map sensor IDs to their station names as a categorical
+    def station_names(self, sensor_ids):
+        return map_categorical(sensor_ids, self._names)
+
+# Function to build the station registry from the ARPA station list CSV (through the snapshot cache)
+def load_station_registry(path, cache_dir=CACHE_DIR):
+    return StationRegistry(load_station_data_cached(path, cache_dir))
+
+# Function to build the named station groups used in the report from the ARPA station list
+def station_groups(map_data):
+    registry = map_data if isinstance(map_data, StationRegistry) else StationRegistry(map_data)
+    groups = {}
+    for pollutant in SENSOR_TYPES:
+        groups[f'{pollutant}_lombardia'] = list(registry.sensors(pollutant=pollutant))
+    groups['pm25_milan'] = list(MILAN_PM25_STATIONS)
+    groups['pm10_milan'] = list(MILAN_PM10_STATIONS)
+    return groups
+
+# Function to sum the valid 'Valore' readings of every sensor for every day
+@profiled
+def sensor_daily_sums(data, sensors=None):
+    add_timestamps(data)
+    if sensors is not None:
+        data = data[data['IdSensore'].isin(sensors)]
+    # recode -9999.0 (and readings failing quality_check) to NA
+    values = valid_values(data)
+    days = data['timestamp'].dt.normalize()
+    # one groupby over (sensor, day); 'count' skips NA readings just like mean() does
+    sums = values.groupby([data['IdSensore'], days]).agg(['sum', 'count'])
+    sums.index.names = ['IdSensore', 'date']
+    return sums.reset_index()
+
+# Function to compute daily and yearly means for many named station groups in one pass
+@profiled
+def aggregate_station_groups(data, groups):
+    sensors = set()
+    for group_sensors in groups.values():
+        sensors.update(group_sensors)
+    sums = sensor_daily_sums(data, sorted(sensors))
+    return reduce_station_groups(sums, groups)
+
+# Function to turn per-sensor daily sums and counts into daily and yearly means per station group
+@profiled
+def reduce_station_groups(sums, groups):
+    # one row per (group, sensor), so a sensor can belong to several groups
+    membership = pd.DataFrame(
+        [(group, sensor) for group, group_sensors in groups.items() for sensor in group_sensors],
+        columns=['group', 'IdSensore']
+    ).drop_duplicates()
+    sums = membership.merge(sums, on='IdSensore')
+
+    # pooling sums and counts gives the same mean as averaging all readings of the group
+    daily = sums.groupby(['group', 'date'], sort=True)[['sum', 'count']].sum().reset_index()
+    daily['Valore'] = daily['sum'] / daily['count'].where(daily['count'] > 0)
+    daily['date'] = timestamps_to_dates(daily['date'])
+
+    sums['year'] = sums['date'].dt.year
+    yearly = sums.groupby(['group', 'year'], sort=True)[['sum', 'count']].sum().reset_index()
+    yearly['Valore'] = yearly['sum'] / yearly['count'].where(yearly['count'] > 0)
+
+    return daily[['group', 'date', 'Valore']], yearly[['group', 'year', 'Valore']]
+
+# columns kept for every observation in the snapshot store
+STORE_COLUMNS = ['IdSensore', 'timestamp', 'Valore', 'Stato']
+
+# Function to drop repeated (IdSensore, timestamp) observations, keeping the last one seen
+def deduplicate_observations(data):
+    return data.drop_duplicates(subset=['IdSensore', 'timestamp'], keep='last')
+
+# Function to list the monthly partitions of a snapshot store
+def _store_months(store_dir):
+    obs_dir = os.path.join(store_dir, 'obs')
+    if not os.path.isdir(obs_dir):
+        return []
+    return sorted(m for m in os.listdir(obs_dir) if not m.endswith('.tmp'))
+
+# Function to add a new ARPA snapshot to the store, recomputing only the days it changes
+@profiled
+def update_observation_store(store_dir, data):
+    add_timestamps(data)
+    # the quality flag is stored with the observations when the snapshot went through quality_check
+    new = data[STORE_COLUMNS + (['valid'] if 'valid' in data.columns else [])].copy()
+    new['Valore'] = new['Valore'].where(new['Valore'] != -9999.0)
+    new = deduplicate_observations(new)
+    # integer month keys (year * 100 + month); only the distinct keys are formatted as names
+    months = (new['timestamp'].dt.year * 100 + new['timestamp'].dt.month).to_numpy()
+
+    changed = []
+    for key, month_new in new.groupby(months):
+        month = f'{int(key) // 100:04d}-{int(key) % 100:02d}'
+        month_dir = os.path.join(store_dir, 'obs', month)
+        if os.path.exists(month_dir):
+            month_old = load_frame(month_dir, mmap=False)
+            # observations that are new or whose value changed since the last snapshot
+            flags = ['valid'] if 'valid' in month_new.columns and 'valid' in month_old.columns else []
+            merged = month_new.merge(month_old[['IdSensore', 'timestamp', 'Valore'] + flags],
+                                     on=['IdSensore', 'timestamp'], how='left', suffixes=('', '_old'),
+                                     indicator=True)
+            same = (merged['_merge'] == 'both') & (
+                (merged['Valore'] == merged['Valore_old'])
+                | (merged['Valore'].isna() & merged['Valore_old'].isna())
+            )
+            for flag in flags:
+                same &= merged[flag] == merged[f'{flag}_old']
+            month_changed = month_new[~same.to_numpy()]
+            if month_changed.empty:
+                continue
+            # newest snapshot wins
+            month_all = deduplicate_observations(pd.concat([month_old, month_changed], ignore_index=True))
+        else:
+            month_changed = month_all = month_new
+        save_frame(month_all.sort_values(['IdSensore', 'timestamp']).reset_index(drop=True), month_dir)
+        changed.append((month, month_changed, month_all))
+
+    if not changed:
+        return 0
+
+    _split_store_daily(store_dir)
+    # the daily sums are partitioned by month too, so only the months changed are rewritten
+    for month, month_changed, month_all in changed:
+        # only the (sensor, day) pairs touched by the new observations are recomputed
+        keys = month_changed[['IdSensore']].assign(date=month_changed['timestamp'].dt.normalize()).drop_duplicates()
+        rows = month_all.assign(date=month_all['timestamp'].dt.normalize()).merge(keys, on=['IdSensore', 'date'])
+        if 'valid' in rows.columns:
+            # whole days are recomputed, so their completeness can be too; the sensors' cadence
+            # comes from the whole month, not from the few days touched
+            rows['day_complete'] = complete_days(rows, expected=readings_per_day(month_all))
+        recomputed = sensor_daily_sums(rows.drop(columns='date'))
+        daily_dir = os.path.join(store_dir, 'daily', month)
+        if os.path.exists(daily_dir):
+            daily = load_frame(daily_dir, mmap=False)
+            untouched = daily.merge(keys, on=['IdSensore', 'date'], how='left', indicator=True)['_merge'] == 'left_only'
+            recomputed = pd.concat([daily[untouched.to_numpy()], recomputed], ignore_index=True)
+        save_frame(recomputed.sort_values(['IdSensore', 'date']).reset_index(drop=True), daily_dir)
+    return sum(len(month_changed) for _, month_changed, _ in changed)
+
+# Function to split the single daily sums table of older stores into the monthly partitions
+def _split_store_daily(store_dir):
+    daily_dir = os.path.join(store_dir, 'daily')
+    if not os.path.exists(os.path.join(daily_dir, 'columns.json')):
+        return
+    daily = load_frame(daily_dir, mmap=False)
+    shutil.rmtree(daily_dir)
+    months = (daily['date'].dt.year * 100 + daily['date'].dt.month).to_numpy()
+    for key, month_daily in daily.groupby(months):
+        save_frame(month_daily.reset_index(drop=True),
+                   os.path.join(daily_dir, f'{int(key) // 100:04d}-{int(key) % 100:02d}'))
+
+# Function to read the store's per-sensor daily sums (IdSensore, date, sum, count)
+def load_store_daily(store_dir):
+    daily_dir = os.path.join(store_dir, 'daily')
+    if os.path.exists(os.path.join(daily_dir, 'columns.json')):
+        return load_frame(daily_dir)
+    months = sorted(month for month in os.listdir(daily_dir) if not month.endswith('.tmp')) \
+        if os.path.isdir(daily_dir) else []
+    if not months:
+        return pd.DataFrame({'IdSensore': pd.Series(dtype='int32'), 'date': pd.Series(dtype='datetime64[ns]'),
+                             'sum': pd.Series(dtype='float64'), 'count': pd.Series(dtype='int64')})
+    daily = pd.concat([load_frame(os.path.join(daily_dir, month)) for month in months], ignore_index=True)
+    return daily.sort_values(['IdSensore', 'date']).reset_index(drop=True)
+
+# Function to read observations back from the store, optionally only some sensors and dates
+@profiled
+def load_observation_store(store_dir, sensors=None, start_date=None, end_date=None):
+    start_month = pd.to_datetime(start_date).strftime('%Y-%m') if start_date is not None else None
+    end_month = pd.to_datetime(end_date).strftime('%Y-%m') if end_date is not None else None
+    frames = []
+    for month in _store_months(store_dir):
+        if (start_month and month < start_month) or (end_month and month > end_month):
+            continue
+        frame = load_frame(os.path.join(store_dir, 'obs', month))
+        if sensors is not None:
+            frame = frame[frame['IdSensore'].isin(sensors)]
+        frames.append(frame)
+    if not frames:
+        return pd.DataFrame(columns=STORE_COLUMNS)
+    data = pd.concat(frames, ignore_index=True)
+    if start_date is not None:
+        data = data[data['timestamp'] >= pd.to_datetime(start_date)]
+    if end_date is not None:
+        data = data[data['timestamp'] < pd.to_datetime(end_date) + pd.Timedelta(days=1)]
+    return data.reset_index(drop=True)
+
+# Function to get daily and yearly means per station group from the store's per-sensor daily sums
+def store_group_aggregates(store_dir, groups):
+    sums = load_store_daily(store_dir)
+    return reduce_station_groups(sums, groups)
+
+# Function to reduce hourly readings ('date' holding timestamps with times of day, or repeated days)
+# to daily means, so that statistics count days rather than hours; daily input is returned as is
+def to_daily_means(data, by=()):
+    by = list(by)
+    if not pd.api.types.is_datetime64_any_dtype(data['date']):
+        return data
+    days = data['date'].dt.normalize()
+    if not (days != data['date']).any() and not data[by].assign(date=days).duplicated().any():
+        return data
+    daily = data['Valore'].groupby([data[col] for col in by] + [days.rename('date')], sort=True).mean()
+    return daily.reset_index()
+
+# Function to compute per-year exceedance and compliance statistics from daily means in one grouped pass
+#   daily: frame with 'date' and 'Valore' (daily means), plus any grouping columns listed in `by`
+#   thresholds: days with a daily mean above each threshold are counted in 'days_above_<threshold>'
+#   nth: for each n, the n-th highest daily mean of the year in 'highest_<n>' (e.g. 36 for the EU PM10 rule)
+@profiled
+def exceedance_stats(daily, thresholds=(), nth=(), by=()):
+    by = list(by)
+    daily = to_daily_means(daily, by)
+    values = daily['Valore'].to_numpy(dtype='float64')
+    stats = daily[by].copy()
+    stats['year'] = pd.to_datetime(daily['date']).dt.year.to_numpy()
+    keys = by + ['year']
+    stats['date'] = pd.to_datetime(daily['date']).to_numpy()
+    stats['n_days'] = ~np.isnan(values)
+    stats['mean'] = values
+    # one boolean column per threshold, all counted by the same groupby
+    for threshold in thresholds:
+        stats[f'days_above_{threshold:g}'] = values > threshold
+
+    grouped = stats.groupby(keys, sort=True)
+    table = grouped.agg(
+        first_date=('date', 'min'),
+        last_date=('date', 'max'),
+        n_days=('n_days', 'sum'),
+        mean=('mean', 'mean'),
+    )
+    if thresholds:
+        table = table.join(grouped[[f'days_above_{threshold:g}' for threshold in thresholds]].sum())
+
+    if nth:
+        # rank the days of each group-year from the highest mean down
+        ranked = stats.loc[~np.isnan(values), keys + ['mean']].sort_values(
+            keys + ['mean'], ascending=[True] * len(keys) + [False])
+        ranked['rank'] = ranked.groupby(keys).cumcount() + 1
+        for n in nth:
+            table[f'highest_{n}'] = ranked[ranked['rank'] == n].set_index(keys)['mean']
+
+    return table.reset_index()
+
+# matplotlib style of the charts ('seaborn-white' was renamed in matplotlib 3.6)
+PLOT_STYLE = 'seaborn-white' if 'seaborn-white' in plt.style.available else 'seaborn-v0_8-white'
+
+# Function to decimate a date-sorted series to about max_points rows while keeping its shape:
+# the series is cut into equal-size buckets and each bucket keeps its minimum and maximum
+def downsample_minmax(data, max_points, y='Valore'):
+    n = len(data)
+    if n <= max_points:
+        return data
+    values = data[y].to_numpy(dtype='float64')
+    # two points per bucket
+    buckets = np.arange(n) * max(max_points // 2, 1) // n
+    # sort by (bucket, value): the first row of each bucket is its minimum, the last its maximum
+    # (missing values are sorted so that they are only picked when the whole bucket is missing)
+    order_min = np.lexsort((np.where(np.isnan(values), np.inf, values), buckets))
+    order_max = np.lexsort((np.where(np.isnan(values), -np.inf, values), buckets))
+    starts = np.flatnonzero(np.r_[True, np.diff(buckets[order_min]) != 0])
+    ends = np.r_[starts[1:], n] - 1
+    keep = np.unique(np.concatenate([order_min[starts], order_max[ends], [0, n - 1]]))
+    return data.iloc[keep]
+
+# Function to keep the rows between two dates (inclusive), for daily dates or hourly timestamps
+def filter_dates(data, start_date, end_date):
+    if pd.api.types.is_datetime64_any_dtype(data['date']):
+        return data[(data['date'] >= pd.Timestamp(start_date))
+                    & (data['date'] < pd.Timestamp(end_date) + pd.Timedelta(days=1))]
+    return data[(data['date'] >= start_date) & (data['date'] <= end_date)]
+
+# Function to give the position of a chart label `days` days after the first plotted date
+# (the charts are laid out in days, whether the series is daily or hourly)
+def label_date(data, days):
+    return data['date'].iloc[0] + pd.Timedelta(days=days)
+
+# Function to put month ticks on a date axis, spacing them out on long date ranges
+def format_date_axis(ax, start_date, end_date, max_ticks=36):
+    months = (end_date.year - start_date.year) * 12 + end_date.month - start_date.month + 1
+    interval = max(1, int(np.ceil(months / max_ticks)))
+    ax.xaxis.set_major_locator(mdates.MonthLocator(interval=interval))
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%m-%Y'))
+
+@profiled
+def plot_air_quality_25_milan(data, city, start_date, end_date, save=False, annotation=True, stats=None, max_points=None):
     UE_limit = 25
     WHO_limit = 15
+    alarm_limit = 50
 
     UE_limit_annual = 10
     WHO_limit_annual = 5
 
-    # Sorting DataFrame by date within each station group
-    data.sort_values('date', inplace=True)
+    # Sorting DataFrame by date within each station group (skipped when already sorted)
+    if not data['date'].is_monotonic_increasing:
+        data.sort_values('date', inplace=True)
 
     # Filter data to all times
     start_date = pd.to_datetime(start_date).date()
     end_date = pd.to_datetime(end_date).date()
 
-    filtered_data = data[(data['date'] >= start_date) & (data['date'] <= end_date)]
-    days_above_EU = filtered_data[filtered_data['Valore'] > UE_limit].nunique()['Valore']
-    days_above_alarm = filtered_data[filtered_data['Valore'] > 50].nunique()['Valore']
-    days_above_OMS = filtered_data[filtered_data['Valore'] > WHO_limit].nunique()['Valore']
+    filtered_data = filter_dates(data, start_date, end_date)
 
     if annotation:
-        # Count number of days where in 2023
-        start_2023 = pd.to_datetime('01/01/2023').date()
-        end_2023 = pd.to_datetime('12/31/2023').date()
-
-        data_2023 = data[(data['date'] >= start_2023) & (data['date'] <= end_2023)]
-        days_above_EU_2023 = data_2023[data_2023['Valore'] > UE_limit].nunique()['Valore']
-        days_above_alarm_2023 = data_2023[data_2023['Valore'] > 50].nunique()['Valore']
-        days_above_OMS_2023 = data_2023[data_2023['Valore'] > WHO_limit].nunique()['Valore']
-
-        avg_2023 = data_2023['Valore'].mean()
-
-        # Count number of days where in 2024
-        start_2024 = pd.to_datetime('01/01/2024').date()
-        end_2024 = pd.to_datetime('12/31/2024').date()
-
-        data_2024 = data[(data['date'] >= start_2024) & (data['date'] <= end_2024)]
-        days_above_EU_2024 = data_2024[data_2024['Valore'] > UE_limit].nunique()['Valore']
-        days_above_alarm_2024 = data_2024[data_2024['Valore'] > 50].nunique()['Valore']
-        days_above_OMS_2024 = data_2024[data_2024['Valore'] > WHO_limit].nunique()['Valore']
-
-        avg_2024 = data_2024['Valore'].mean()
-
-        # Count number of days where in 2025
-        start_2025 = pd.to_datetime('01/01/2025').date()
-        end_2025 = pd.to_datetime('01/31/2025').date()
-
-        data_2025 = data[(data['date'] >= start_2025) & (data['date'] <= end_2025)]
-        days_above_EU_2025 = data_2025[data_2025['Valore'] > UE_limit].nunique()['Valore']
-        days_above_alarm_2025 = data_2025[data_2025['Valore'] > 50].nunique()['Valore']
-        days_above_OMS_2025 = data_2025[data_2025['Valore'] > WHO_limit].nunique()['Valore']
-
-    # Calculate average value for each station
-    average = filtered_data['Valore'].mean()
+        # days above each limit and annual means per year, from one grouped pass over the daily means
+        if stats is None:
+            stats = exceedance_stats(data, [WHO_limit, UE_limit, alarm_limit])
+        year_stats = stats.set_index('year')
+        days_above_OMS = year_stats[f'days_above_{WHO_limit:g}']
+        days_above_EU = year_stats[f'days_above_{UE_limit:g}']
+        days_above_alarm = year_stats[f'days_above_{alarm_limit:g}']
+        avg = year_stats['mean']
 
     # Plotting
     plt.figure(figsize=(8, 6))
+    # decimate long series, keeping each bucket's minimum and maximum
+    plot_data = filtered_data if max_points is None else downsample_minmax(filtered_data, max_points)
     plt.plot(
-        filtered_data['date'], 
-        filtered_data['Valore'],
+        plot_data['date'],
+        plot_data['Valore'],
         label=f'ARPA (media di 3 stazioni)',
         linewidth=3
     )
@@ -196,50 +952,50 @@ def plot_air_quality_25_milan(data, city, start_date, end_date, save=False, anno
     # horizontal dashed line for EU and WHO limits
     plt.axhline(y=WHO_limit, color='black', linestyle='--')
     plt.axhline(y=UE_limit, color='gray', linestyle='--')
-    plt.axhline(y=50, color='red', linestyle='--')
+    plt.axhline(y=alarm_limit, color='red', linestyle='--')
 
     plt.annotate(
         'Limite UE', 
-        xy=(filtered_data['date'].iloc[110], UE_limit), 
-        xytext=(filtered_data['date'].iloc[110], UE_limit+10),
+        xy=(label_date(filtered_data, 110), UE_limit), 
+        xytext=(label_date(filtered_data, 110), UE_limit+10),
         arrowprops=dict(facecolor='black', arrowstyle='-')
     )
 
     plt.annotate(
         'Limite OMS', 
-        xy=(filtered_data['date'].iloc[150], WHO_limit), 
-        xytext=(filtered_data['date'].iloc[150], WHO_limit+15),
+        xy=(label_date(filtered_data, 150), WHO_limit), 
+        xytext=(label_date(filtered_data, 150), WHO_limit+15),
         arrowprops=dict(facecolor='black', arrowstyle='-')
     )
 
-    plt.text(filtered_data['date'].iloc[90], 52, "Soglia proposta per l'allarme")
+    plt.text(label_date(filtered_data, 90), 52, "Soglia proposta per l'allarme")
 
     if annotation:
-        plt.text(filtered_data['date'].iloc[0], 80, f"Giorni sopra il limite OMS nel 2023: {days_above_OMS_2023}")
-        plt.text(filtered_data['date'].iloc[0], 85, f"Giorni sopra il limite UE nel 2023: {days_above_EU_2023}")
-        plt.text(filtered_data['date'].iloc[0], 90, f"Giorni sopra la soglia d'allarme nel 2023: {days_above_alarm_2023}")
+        plt.text(filtered_data['date'].iloc[0], 80, f"Giorni sopra il limite OMS nel 2023: {days_above_OMS.get(2023, 0)}")
+        plt.text(filtered_data['date'].iloc[0], 85, f"Giorni sopra il limite UE nel 2023: {days_above_EU.get(2023, 0)}")
+        plt.text(filtered_data['date'].iloc[0], 90, f"Giorni sopra la soglia d'allarme nel 2023: {days_above_alarm.get(2023, 0)}")
 
-        plt.text(filtered_data['date'].iloc[0], 100, f"Giorni sopra il limite OMS nel 2024: {days_above_OMS_2024}")
-        plt.text(filtered_data['date'].iloc[0], 105, f"Giorni sopra il limite UE nel 2024: {days_above_EU_2024}")
-        plt.text(filtered_data['date'].iloc[0], 110, f"Giorni sopra la soglia d'allarme nel 2024: {days_above_alarm_2024}")
+        plt.text(filtered_data['date'].iloc[0], 100, f"Giorni sopra il limite OMS nel 2024: {days_above_OMS.get(2024, 0)}")
+        plt.text(filtered_data['date'].iloc[0], 105, f"Giorni sopra il limite UE nel 2024: {days_above_EU.get(2024, 0)}")
+        plt.text(filtered_data['date'].iloc[0], 110, f"Giorni sopra la soglia d'allarme nel 2024: {days_above_alarm.get(2024, 0)}")
 
-        plt.text(filtered_data['date'].iloc[0], 120, f"Giorni sopra il limite OMS nel 2025: {days_above_OMS_2025}")
-        plt.text(filtered_data['date'].iloc[0], 125, f"Giorni sopra il limite UE nel 2025: {days_above_EU_2025}")
-        plt.text(filtered_data['date'].iloc[0], 130, f"Giorni sopra la soglia d'allarme nel 2025: {days_above_alarm_2025}")
+        plt.text(filtered_data['date'].iloc[0], 120, f"Giorni sopra il limite OMS nel 2025: {days_above_OMS.get(2025, 0)}")
+        plt.text(filtered_data['date'].iloc[0], 125, f"Giorni sopra il limite UE nel 2025: {days_above_EU.get(2025, 0)}")
+        plt.text(filtered_data['date'].iloc[0], 130, f"Giorni sopra la soglia d'allarme nel 2025: {days_above_alarm.get(2025, 0)}")
 
-        plt.text(filtered_data['date'].iloc[450], 105, f"Media di PM2.5 nel 2023: {avg_2023:.2f} \n(limite UE: {UE_limit_annual}, limite OMS: {WHO_limit_annual})")
-        plt.text(filtered_data['date'].iloc[450], 125, f"Media di PM2.5 nel 2024: {avg_2024:.2f} \n(limite UE: {UE_limit_annual}, limite OMS: {WHO_limit_annual})")
+        plt.text(label_date(filtered_data, 450), 105, f"Media di PM2.5 nel 2023: {avg.get(2023, np.nan):.2f} \n(limite UE: {UE_limit_annual}, limite OMS: {WHO_limit_annual})")
+        plt.text(label_date(filtered_data, 450), 125, f"Media di PM2.5 nel 2024: {avg.get(2024, np.nan):.2f} \n(limite UE: {UE_limit_annual}, limite OMS: {WHO_limit_annual})")
 
     plt.yticks(range(0, int(filtered_data['Valore'].max()) + 5, 5))
-    plt.xticks(filtered_data['date'], rotation=45, ha='right', fontsize=8)
-    plt.gca().xaxis.set_major_locator(mdates.MonthLocator(bymonth=range(1, 13, 1)))
-    plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%m-%Y'))
+    # month ticks set directly on the axis (not one tick per data point)
+    format_date_axis(plt.gca(), start_date, end_date)
+    plt.xticks(rotation=45, ha='right', fontsize=8)
 
     legend = plt.legend(frameon=False, loc='upper left')
     for line in legend.get_lines():
         line.set_linewidth(4)
 
-    plt.style.use('seaborn-white')
+    plt.style.use(PLOT_STYLE)
     plt.tick_params(axis='x', direction='out', length=4, width=1, colors='black')
 
     plt.xlabel('')
@@ -251,7 +1007,8 @@ def plot_air_quality_25_milan(data, city, start_date, end_date, save=False, anno
 
 
 
-def plot_air_quality_pm10_milan(data, city, start_date, end_date, save=False, annotation=True):
+@profiled
+def plot_air_quality_pm10_milan(data, city, start_date, end_date, save=False, annotation=True, stats=None, max_points=None):
     UE_limit = 45
     WHO_limit = 45
     alarm_limit = 90
@@ -259,58 +1016,33 @@ def plot_air_quality_pm10_milan(data, city, start_date, end_date, save=False, an
     UE_limit_annual = 20
     WHO_limit_annual = 15
 
-    # Sorting DataFrame by date within each station group
-    data.sort_values('date', inplace=True)
+    # Sorting DataFrame by date within each station group (skipped when already sorted)
+    if not data['date'].is_monotonic_increasing:
+        data.sort_values('date', inplace=True)
 
     # Filter data to all times
     start_date = pd.to_datetime(start_date).date()
     end_date = pd.to_datetime(end_date).date()
 
-    filtered_data = data[(data['date'] >= start_date) & (data['date'] <= end_date)]
-    days_above_EU = filtered_data[filtered_data['Valore'] > UE_limit].nunique()['Valore']
-    days_above_alarm = filtered_data[filtered_data['Valore'] > alarm_limit].nunique()['Valore']
-    days_above_OMS = filtered_data[filtered_data['Valore'] > WHO_limit].nunique()['Valore']
+    filtered_data = filter_dates(data, start_date, end_date)
 
     if annotation:
-        # Count number of days where in 2023
-        start_2023 = pd.to_datetime('01/01/2023').date()
-        end_2023 = pd.to_datetime('12/31/2023').date()
-
-        data_2023 = data[(data['date'] >= start_2023) & (data['date'] <= end_2023)]
-        days_above_EU_2023 = data_2023[data_2023['Valore'] > UE_limit].nunique()['Valore']
-        days_above_alarm_2023 = data_2023[data_2023['Valore'] > alarm_limit].nunique()['Valore']
-        days_above_OMS_2023 = data_2023[data_2023['Valore'] > WHO_limit].nunique()['Valore']
-
-        avg_2023 = data_2023['Valore'].mean()
-
-        # Count number of days where in 2024
-        start_2024 = pd.to_datetime('01/01/2024').date()
-        end_2024 = pd.to_datetime('12/31/2024').date()
-
-        data_2024 = data[(data['date'] >= start_2024) & (data['date'] <= end_2024)]
-        days_above_EU_2024 = data_2024[data_2024['Valore'] > UE_limit].nunique()['Valore']
-        days_above_alarm_2024 = data_2024[data_2024['Valore'] > alarm_limit].nunique()['Valore']
-        days_above_OMS_2024 = data_2024[data_2024['Valore'] > WHO_limit].nunique()['Valore']
-
-        avg_2024 = data_2024['Valore'].mean()
-
-        # Count number of days where in 2025
-        start_2025 = pd.to_datetime('01/01/2025').date()
-        end_2025 = pd.to_datetime('01/31/2025').date()
-
-        data_2025 = data[(data['date'] >= start_2025) & (data['date'] <= end_2025)]
-        days_above_EU_2025 = data_2025[data_2025['Valore'] > UE_limit].nunique()['Valore']
-        days_above_alarm_2025 = data_2025[data_2025['Valore'] > 50].nunique()['Valore']
-        days_above_OMS_2025 = data_2025[data_2025['Valore'] > WHO_limit].nunique()['Valore']
-
-    # Calculate average value for each station
-    average = filtered_data['Valore'].mean()
+        # days above each limit and annual means per year, from one grouped pass over the daily means
+        if stats is None:
+            stats = exceedance_stats(data, [WHO_limit, UE_limit, alarm_limit])
+        year_stats = stats.set_index('year')
+        days_above_OMS = year_stats[f'days_above_{WHO_limit:g}']
+        days_above_EU = year_stats[f'days_above_{UE_limit:g}']
+        days_above_alarm = year_stats[f'days_above_{alarm_limit:g}']
+        avg = year_stats['mean']
 
     # Plotting
     plt.figure(figsize=(8, 6))
+    # decimate long series, keeping each bucket's minimum and maximum
+    plot_data = filtered_data if max_points is None else downsample_minmax(filtered_data, max_points)
     plt.plot(
-        filtered_data['date'], 
-        filtered_data['Valore'],
+        plot_data['date'],
+        plot_data['Valore'],
         label=f'ARPA (media di 4 stazioni)',
         linewidth=3
     )
@@ -322,47 +1054,47 @@ def plot_air_quality_pm10_milan(data, city, start_date, end_date, save=False, an
 
     plt.annotate(
         'Limite UE / OMS', 
-        xy=(filtered_data['date'].iloc[110], UE_limit), 
-        xytext=(filtered_data['date'].iloc[90], UE_limit+10),
+        xy=(label_date(filtered_data, 110), UE_limit), 
+        xytext=(label_date(filtered_data, 90), UE_limit+10),
         arrowprops=dict(facecolor='black', arrowstyle='-')
     )
 
     # plt.annotate(
     #     'Limite OMS', 
-    #     xy=(filtered_data['date'].iloc[150], WHO_limit), 
-    #     xytext=(filtered_data['date'].iloc[150], WHO_limit+15),
+    #     xy=(label_date(filtered_data, 150), WHO_limit), 
+    #     xytext=(label_date(filtered_data, 150), WHO_limit+15),
     #     arrowprops=dict(facecolor='black', arrowstyle='-')
     # )
 
-    plt.text(filtered_data['date'].iloc[90], 92, "Soglia proposta per l'allarme")
+    plt.text(label_date(filtered_data, 90), 92, "Soglia proposta per l'allarme")
 
     if annotation:
-        plt.text(filtered_data['date'].iloc[0], 120, f"Giorni sopra il limite OMS nel 2023: {days_above_OMS_2023}")
-        plt.text(filtered_data['date'].iloc[0], 125, f"Giorni sopra il limite UE nel 2023: {days_above_EU_2023}")
-        plt.text(filtered_data['date'].iloc[0], 130, f"Giorni sopra la soglia d'allarme nel 2023: {days_above_alarm_2023}")
+        plt.text(filtered_data['date'].iloc[0], 120, f"Giorni sopra il limite OMS nel 2023: {days_above_OMS.get(2023, 0)}")
+        plt.text(filtered_data['date'].iloc[0], 125, f"Giorni sopra il limite UE nel 2023: {days_above_EU.get(2023, 0)}")
+        plt.text(filtered_data['date'].iloc[0], 130, f"Giorni sopra la soglia d'allarme nel 2023: {days_above_alarm.get(2023, 0)}")
 
-        plt.text(filtered_data['date'].iloc[0], 140, f"Giorni sopra il limite OMS nel 2024: {days_above_OMS_2024}")
-        plt.text(filtered_data['date'].iloc[0], 145, f"Giorni sopra il limite UE nel 2024: {days_above_EU_2024}")
-        plt.text(filtered_data['date'].iloc[0], 150, f"Giorni sopra la soglia d'allarme nel 2024: {days_above_alarm_2024}")
+        plt.text(filtered_data['date'].iloc[0], 140, f"Giorni sopra il limite OMS nel 2024: {days_above_OMS.get(2024, 0)}")
+        plt.text(filtered_data['date'].iloc[0], 145, f"Giorni sopra il limite UE nel 2024: {days_above_EU.get(2024, 0)}")
+        plt.text(filtered_data['date'].iloc[0], 150, f"Giorni sopra la soglia d'allarme nel 2024: {days_above_alarm.get(2024, 0)}")
 
-        plt.text(filtered_data['date'].iloc[0], 160, f"Giorni sopra il limite OMS nel 2025: {days_above_OMS_2025}")
-        plt.text(filtered_data['date'].iloc[0], 165, f"Giorni sopra il limite UE nel 2025: {days_above_EU_2025}")
-        plt.text(filtered_data['date'].iloc[0], 170, f"Giorni sopra la soglia d'allarme nel 2025: {days_above_alarm_2025}")
+        plt.text(filtered_data['date'].iloc[0], 160, f"Giorni sopra il limite OMS nel 2025: {days_above_OMS.get(2025, 0)}")
+        plt.text(filtered_data['date'].iloc[0], 165, f"Giorni sopra il limite UE nel 2025: {days_above_EU.get(2025, 0)}")
+        plt.text(filtered_data['date'].iloc[0], 170, f"Giorni sopra la soglia d'allarme nel 2025: {days_above_alarm.get(2025, 0)}")
 
-        plt.text(filtered_data['date'].iloc[450], 145, f"Media di PM2.5 nel 2023: {avg_2023:.2f} \n(limite UE: {UE_limit_annual}, limite OMS: {WHO_limit_annual})")
-        plt.text(filtered_data['date'].iloc[450], 165, f"Media di PM2.5 nel 2024: {avg_2024:.2f} \n(limite UE: {UE_limit_annual}, limite OMS: {WHO_limit_annual})")
+        plt.text(label_date(filtered_data, 450), 145, f"Media di PM2.5 nel 2023: {avg.get(2023, np.nan):.2f} \n(limite UE: {UE_limit_annual}, limite OMS: {WHO_limit_annual})")
+        plt.text(label_date(filtered_data, 450), 165, f"Media di PM2.5 nel 2024: {avg.get(2024, np.nan):.2f} \n(limite UE: {UE_limit_annual}, limite OMS: {WHO_limit_annual})")
 
 
     plt.yticks(range(0, int(filtered_data['Valore'].max()) + 5, 5))
-    plt.xticks(filtered_data['date'], rotation=45, ha='right', fontsize=8)
-    plt.gca().xaxis.set_major_locator(mdates.MonthLocator(bymonth=range(1, 13, 1)))
-    plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%m-%Y'))
+    # month ticks set directly on the axis (not one tick per data point)
+    format_date_axis(plt.gca(), start_date, end_date)
+    plt.xticks(rotation=45, ha='right', fontsize=8)
 
     legend = plt.legend(frameon=False, loc='upper left')
     for line in legend.get_lines():
         line.set_linewidth(4)
 
-    plt.style.use('seaborn-white')
+    plt.style.use(PLOT_STYLE)
     plt.tick_params(axis='x', direction='out', length=4, width=1, colors='black')
 
     plt.xlabel('')
@@ -373,65 +1105,42 @@ def plot_air_quality_pm10_milan(data, city, start_date, end_date, save=False, an
         plt.show()
 
 
-def plot_air_quality_25_lombardia(data, city, start_date, end_date, save=False, annotation=True):
+@profiled
+def plot_air_quality_25_lombardia(data, city, start_date, end_date, save=False, annotation=True, stats=None, max_points=None):
     UE_limit = 25
     WHO_limit = 15
+    alarm_limit = 50
 
     UE_limit_annual = 10
     WHO_limit_annual = 5
 
-    # Sorting DataFrame by date within each station group
-    data.sort_values('date', inplace=True)
+    # Sorting DataFrame by date within each station group (skipped when already sorted)
+    if not data['date'].is_monotonic_increasing:
+        data.sort_values('date', inplace=True)
 
     # Filter data to all times
     start_date = pd.to_datetime(start_date).date()
     end_date = pd.to_datetime(end_date).date()
 
-    filtered_data = data[(data['date'] >= start_date) & (data['date'] <= end_date)]
-    days_above_EU = filtered_data[filtered_data['Valore'] > UE_limit].nunique()['Valore']
-    days_above_alarm = filtered_data[filtered_data['Valore'] > 50].nunique()['Valore']
-    days_above_OMS = filtered_data[filtered_data['Valore'] > WHO_limit].nunique()['Valore']
+    filtered_data = filter_dates(data, start_date, end_date)
 
     if annotation:
-        # Count number of days where in 2023
-        start_2023 = pd.to_datetime('01/01/2023').date()
-        end_2023 = pd.to_datetime('12/31/2023').date()
-
-        data_2023 = data[(data['date'] >= start_2023) & (data['date'] <= end_2023)]
-        days_above_EU_2023 = data_2023[data_2023['Valore'] > UE_limit].nunique()['Valore']
-        days_above_alarm_2023 = data_2023[data_2023['Valore'] > 50].nunique()['Valore']
-        days_above_OMS_2023 = data_2023[data_2023['Valore'] > WHO_limit].nunique()['Valore']
-
-        avg_2023 = data_2023['Valore'].mean()
-
-        # Count number of days where in 2024
-        start_2024 = pd.to_datetime('01/01/2024').date()
-        end_2024 = pd.to_datetime('12/31/2024').date()
-
-        data_2024 = data[(data['date'] >= start_2024) & (data['date'] <= end_2024)]
-        days_above_EU_2024 = data_2024[data_2024['Valore'] > UE_limit].nunique()['Valore']
-        days_above_alarm_2024 = data_2024[data_2024['Valore'] > 50].nunique()['Valore']
-        days_above_OMS_2024 = data_2024[data_2024['Valore'] > WHO_limit].nunique()['Valore']
-
-        avg_2024 = data_2024['Valore'].mean()
-
-        # Count number of days where in 2025
-        start_2025 = pd.to_datetime('01/01/2025').date()
-        end_2025 = pd.to_datetime('01/31/2025').date()
-
-        data_2025 = data[(data['date'] >= start_2025) & (data['date'] <= end_2025)]
-        days_above_EU_2025 = data_2025[data_2025['Valore'] > UE_limit].nunique()['Valore']
-        days_above_alarm_2025 = data_2025[data_2025['Valore'] > 50].nunique()['Valore']
-        days_above_OMS_2025 = data_2025[data_2025['Valore'] > WHO_limit].nunique()['Valore']
-
-    # Calculate average value for each station
-    average = filtered_data['Valore'].mean()
+        # days above each limit and annual means per year, from one grouped pass over the daily means
+        if stats is None:
+            stats = exceedance_stats(data, [WHO_limit, UE_limit, alarm_limit])
+        year_stats = stats.set_index('year')
+        days_above_OMS = year_stats[f'days_above_{WHO_limit:g}']
+        days_above_EU = year_stats[f'days_above_{UE_limit:g}']
+        days_above_alarm = year_stats[f'days_above_{alarm_limit:g}']
+        avg = year_stats['mean']
 
     # Plotting
     plt.figure(figsize=(8, 6))
+    # decimate long series, keeping each bucket's minimum and maximum
+    plot_data = filtered_data if max_points is None else downsample_minmax(filtered_data, max_points)
     plt.plot(
-        filtered_data['date'], 
-        filtered_data['Valore'],
+        plot_data['date'],
+        plot_data['Valore'],
         label=f'ARPA (media di 41 stazioni)',
         linewidth=3
     )
@@ -439,51 +1148,51 @@ def plot_air_quality_25_lombardia(data, city, start_date, end_date, save=False,
     # horizontal dashed line for EU and WHO limits
     plt.axhline(y=WHO_limit, color='black', linestyle='--')
     plt.axhline(y=UE_limit, color='gray', linestyle='--')
-    plt.axhline(y=50, color='red', linestyle='--')
+    plt.axhline(y=alarm_limit, color='red', linestyle='--')
 
     plt.annotate(
         'Limite UE', 
-        xy=(filtered_data['date'].iloc[110], UE_limit), 
-        xytext=(filtered_data['date'].iloc[110], UE_limit+10),
+        xy=(label_date(filtered_data, 110), UE_limit), 
+        xytext=(label_date(filtered_data, 110), UE_limit+10),
         arrowprops=dict(facecolor='black', arrowstyle='-')
     )
 
     plt.annotate(
         'Limite OMS', 
-        xy=(filtered_data['date'].iloc[150], WHO_limit), 
-        xytext=(filtered_data['date'].iloc[150], WHO_limit+15),
+        xy=(label_date(filtered_data, 150), WHO_limit), 
+        xytext=(label_date(filtered_data, 150), WHO_limit+15),
         arrowprops=dict(facecolor='black', arrowstyle='-')
     )
 
-    plt.text(filtered_data['date'].iloc[90], 52, "Soglia proposta per l'allarme")
+    plt.text(label_date(filtered_data, 90), 52, "Soglia proposta per l'allarme")
 
     if annotation:
-        plt.text(filtered_data['date'].iloc[0], 92, f"Giorni sopra il limite OMS nel 2023: {days_above_OMS_2023}")
-        plt.text(filtered_data['date'].iloc[0], 94, f"Giorni sopra il limite UE nel 2023: {days_above_EU_2023}")
-        plt.text(filtered_data['date'].iloc[0], 96, f"Giorni sopra la soglia d'allarme nel 2023: {days_above_alarm_2023}")
+        plt.text(filtered_data['date'].iloc[0], 92, f"Giorni sopra il limite OMS nel 2023: {days_above_OMS.get(2023, 0)}")
+        plt.text(filtered_data['date'].iloc[0], 94, f"Giorni sopra il limite UE nel 2023: {days_above_EU.get(2023, 0)}")
+        plt.text(filtered_data['date'].iloc[0], 96, f"Giorni sopra la soglia d'allarme nel 2023: {days_above_alarm.get(2023, 0)}")
 
-        plt.text(filtered_data['date'].iloc[0], 100, f"Giorni sopra il limite OMS nel 2024: {days_above_OMS_2024}")
-        plt.text(filtered_data['date'].iloc[0], 102, f"Giorni sopra il limite UE nel 2024: {days_above_EU_2024}")
-        plt.text(filtered_data['date'].iloc[0], 104, f"Giorni sopra la soglia d'allarme nel 2024: {days_above_alarm_2024}")
+        plt.text(filtered_data['date'].iloc[0], 100, f"Giorni sopra il limite OMS nel 2024: {days_above_OMS.get(2024, 0)}")
+        plt.text(filtered_data['date'].iloc[0], 102, f"Giorni sopra il limite UE nel 2024: {days_above_EU.get(2024, 0)}")
+        plt.text(filtered_data['date'].iloc[0], 104, f"Giorni sopra la soglia d'allarme nel 2024: {days_above_alarm.get(2024, 0)}")
 
-        plt.text(filtered_data['date'].iloc[0], 108, f"Giorni sopra il limite OMS nel 2025: {days_above_OMS_2025}")
-        plt.text(filtered_data['date'].iloc[0], 110, f"Giorni sopra il limite UE nel 2025: {days_above_EU_2025}")
-        plt.text(filtered_data['date'].iloc[0], 112, f"Giorni sopra la soglia d'allarme nel 2025: {days_above_alarm_2025}")
+        plt.text(filtered_data['date'].iloc[0], 108, f"Giorni sopra il limite OMS nel 2025: {days_above_OMS.get(2025, 0)}")
+        plt.text(filtered_data['date'].iloc[0], 110, f"Giorni sopra il limite UE nel 2025: {days_above_EU.get(2025, 0)}")
+        plt.text(filtered_data['date'].iloc[0], 112, f"Giorni sopra la soglia d'allarme nel 2025: {days_above_alarm.get(2025, 0)}")
 
-        plt.text(filtered_data['date'].iloc[450], 98, f"Media di PM2.5 nel 2023: {avg_2023:.2f} \n(limite UE: {UE_limit_annual}, limite OMS: {WHO_limit_annual})")
-        plt.text(filtered_data['date'].iloc[450], 106, f"Media di PM2.5 nel 2024: {avg_2024:.2f} \n(limite UE: {UE_limit_annual}, limite OMS: {WHO_limit_annual})")
+        plt.text(label_date(filtered_data, 450), 98, f"Media di PM2.5 nel 2023: {avg.get(2023, np.nan):.2f} \n(limite UE: {UE_limit_annual}, limite OMS: {WHO_limit_annual})")
+        plt.text(label_date(filtered_data, 450), 106, f"Media di PM2.5 nel 2024: {avg.get(2024, np.nan):.2f} \n(limite UE: {UE_limit_annual}, limite OMS: {WHO_limit_annual})")
 
 
     plt.yticks(range(0, int(filtered_data['Valore'].max()) + 5, 5))
-    plt.xticks(filtered_data['date'], rotation=45, ha='right', fontsize=8)
-    plt.gca().xaxis.set_major_locator(mdates.MonthLocator(bymonth=range(1, 13, 1)))
-    plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%m-%Y'))
+    # month ticks set directly on the axis (not one tick per data point)
+    format_date_axis(plt.gca(), start_date, end_date)
+    plt.xticks(rotation=45, ha='right', fontsize=8)
 
     legend = plt.legend(frameon=False, loc='upper left')
     for line in legend.get_lines():
         line.set_linewidth(4)
 
-    plt.style.use('seaborn-white')
+    plt.style.use(PLOT_STYLE)
     plt.tick_params(axis='x', direction='out', length=4, width=1, colors='black')
 
     plt.xlabel('')
@@ -494,7 +1203,8 @@ def plot_air_quality_25_lombardia(data, city, start_date, end_date, save=False,
         plt.show()
 
 
-def plot_air_quality_pm10_lombardia(data, city, start_date, end_date, save=False, annotation=True):
+@profiled
+def plot_air_quality_pm10_lombardia(data, city, start_date, end_date, save=False, annotation=True, stats=None, max_points=None):
     UE_limit = 45
     WHO_limit = 45
     alarm_limit = 90
@@ -502,58 +1212,33 @@ def plot_air_quality_pm10_lombardia(data, city, start_date, end_date, save=False
     UE_limit_annual = 20
     WHO_limit_annual = 15
 
-    # Sorting DataFrame by date within each station group
-    data.sort_values('date', inplace=True)
+    # Sorting DataFrame by date within each station group (skipped when already sorted)
+    if not data['date'].is_monotonic_increasing:
+        data.sort_values('date', inplace=True)
 
     # Filter data to all times
     start_date = pd.to_datetime(start_date).date()
     end_date = pd.to_datetime(end_date).date()
 
-    filtered_data = data[(data['date'] >= start_date) & (data['date'] <= end_date)]
-    days_above_EU = filtered_data[filtered_data['Valore'] > UE_limit].nunique()['Valore']
-    days_above_alarm = filtered_data[filtered_data['Valore'] > alarm_limit].nunique()['Valore']
-    days_above_OMS = filtered_data[filtered_data['Valore'] > WHO_limit].nunique()['Valore']
+    filtered_data = filter_dates(data, start_date, end_date)
 
     if annotation:
-        # Count number of days where in 2023
-        start_2023 = pd.to_datetime('01/01/2023').date()
-        end_2023 = pd.to_datetime('12/31/2023').date()
-
-        data_2023 = data[(data['date'] >= start_2023) & (data['date'] <= end_2023)]
-        days_above_EU_2023 = data_2023[data_2023['Valore'] > UE_limit].nunique()['Valore']
-        days_above_alarm_2023 = data_2023[data_2023['Valore'] > alarm_limit].nunique()['Valore']
-        days_above_OMS_2023 = data_2023[data_2023['Valore'] > WHO_limit].nunique()['Valore']
-
-        avg_2023 = data_2023['Valore'].mean()
-
-        # Count number of days where in 2024
-        start_2024 = pd.to_datetime('01/01/2024').date()
-        end_2024 = pd.to_datetime('12/31/2024').date()
-
-        data_2024 = data[(data['date'] >= start_2024) & (data['date'] <= end_2024)]
-        days_above_EU_2024 = data_2024[data_2024['Valore'] > UE_limit].nunique()['Valore']
-        days_above_alarm_2024 = data_2024[data_2024['Valore'] > alarm_limit].nunique()['Valore']
-        days_above_OMS_2024 = data_2024[data_2024['Valore'] > WHO_limit].nunique()['Valore']
-
-        avg_2024 = data_2024['Valore'].mean()
-
-        # Count number of days where in 2025
-        start_2025 = pd.to_datetime('01/01/2025').date()
-        end_2025 = pd.to_datetime('01/31/2025').date()
-
-        data_2025 = data[(data['date'] >= start_2025) & (data['date'] <= end_2025)]
-        days_above_EU_2025 = data_2025[data_2025['Valore'] > UE_limit].nunique()['Valore']
-        days_above_alarm_2025 = data_2025[data_2025['Valore'] > 50].nunique()['Valore']
-        days_above_OMS_2025 = data_2025[data_2025['Valore'] > WHO_limit].nunique()['Valore']
-
-    # Calculate average value for each station
-    average = filtered_data['Valore'].mean()
+        # days above each limit and annual means per year, from one grouped pass over the daily means
+        if stats is None:
+            stats = exceedance_stats(data, [WHO_limit, UE_limit, alarm_limit])
+        year_stats = stats.set_index('year')
+        days_above_OMS = year_stats[f'days_above_{WHO_limit:g}']
+        days_above_EU = year_stats[f'days_above_{UE_limit:g}']
+        days_above_alarm = year_stats[f'days_above_{alarm_limit:g}']
+        avg = year_stats['mean']
 
     # Plotting
     plt.figure(figsize=(8, 6))
+    # decimate long series, keeping each bucket's minimum and maximum
+    plot_data = filtered_data if max_points is None else downsample_minmax(filtered_data, max_points)
     plt.plot(
-        filtered_data['date'], 
-        filtered_data['Valore'],
+        plot_data['date'],
+        plot_data['Valore'],
         label=f'ARPA (media di 91 stazioni)',
         linewidth=3
     )
@@ -565,46 +1250,46 @@ def plot_air_quality_pm10_lombardia(data, city, start_date, end_date, save=False
 
     plt.annotate(
         'Limite UE / OMS', 
-        xy=(filtered_data['date'].iloc[110], UE_limit), 
-        xytext=(filtered_data['date'].iloc[90], UE_limit+10),
+        xy=(label_date(filtered_data, 110), UE_limit), 
+        xytext=(label_date(filtered_data, 90), UE_limit+10),
         arrowprops=dict(facecolor='black', arrowstyle='-')
     )
 
     # plt.annotate(
     #     'Limite OMS', 
-    #     xy=(filtered_data['date'].iloc[150], WHO_limit), 
-    #     xytext=(filtered_data['date'].iloc[150], WHO_limit+15),
+    #     xy=(label_date(filtered_data, 150), WHO_limit), 
+    #     xytext=(label_date(filtered_data, 150), WHO_limit+15),
     #     arrowprops=dict(facecolor='black', arrowstyle='-')
     # )
 
-    plt.text(filtered_data['date'].iloc[90], 86, "Soglia proposta per l'allarme")
+    plt.text(label_date(filtered_data, 90), 86, "Soglia proposta per l'allarme")
 
     if annotation:
-        plt.text(filtered_data['date'].iloc[0], 104, f"Giorni sopra il limite OMS nel 2023: {days_above_OMS_2023}")
-        plt.text(filtered_data['date'].iloc[0], 107, f"Giorni sopra il limite UE nel 2023: {days_above_EU_2023}")
-        plt.text(filtered_data['date'].iloc[0], 110, f"Giorni sopra la soglia d'allarme nel 2023: {days_above_alarm_2023}")
+        plt.text(filtered_data['date'].iloc[0], 104, f"Giorni sopra il limite OMS nel 2023: {days_above_OMS.get(2023, 0)}")
+        plt.text(filtered_data['date'].iloc[0], 107, f"Giorni sopra il limite UE nel 2023: {days_above_EU.get(2023, 0)}")
+        plt.text(filtered_data['date'].iloc[0], 110, f"Giorni sopra la soglia d'allarme nel 2023: {days_above_alarm.get(2023, 0)}")
 
-        plt.text(filtered_data['date'].iloc[0], 115, f"Giorni sopra il limite OMS nel 2024: {days_above_OMS_2024}")
-        plt.text(filtered_data['date'].iloc[0], 118, f"Giorni sopra il limite UE nel 2024: {days_above_EU_2024}")
-        plt.text(filtered_data['date'].iloc[0], 121, f"Giorni sopra la soglia d'allarme nel 2024: {days_above_alarm_2024}")
+        plt.text(filtered_data['date'].iloc[0], 115, f"Giorni sopra il limite OMS nel 2024: {days_above_OMS.get(2024, 0)}")
+        plt.text(filtered_data['date'].iloc[0], 118, f"Giorni sopra il limite UE nel 2024: {days_above_EU.get(2024, 0)}")
+        plt.text(filtered_data['date'].iloc[0], 121, f"Giorni sopra la soglia d'allarme nel 2024: {days_above_alarm.get(2024, 0)}")
 
-        plt.text(filtered_data['date'].iloc[0], 126, f"Giorni sopra il limite OMS nel 2025: {days_above_OMS_2025}")
-        plt.text(filtered_data['date'].iloc[0], 129, f"Giorni sopra il limite UE nel 2025: {days_above_EU_2025}")
-        plt.text(filtered_data['date'].iloc[0], 132, f"Giorni sopra la soglia d'allarme nel 2025: {days_above_alarm_2025}")
+        plt.text(filtered_data['date'].iloc[0], 126, f"Giorni sopra il limite OMS nel 2025: {days_above_OMS.get(2025, 0)}")
+        plt.text(filtered_data['date'].iloc[0], 129, f"Giorni sopra il limite UE nel 2025: {days_above_EU.get(2025, 0)}")
+        plt.text(filtered_data['date'].iloc[0], 132, f"Giorni sopra la soglia d'allarme nel 2025: {days_above_alarm.get(2025, 0)}")
 
-        plt.text(filtered_data['date'].iloc[450], 108, f"Media di PM2.5 nel 2023: {avg_2023:.2f} \n(limite UE: {UE_limit_annual}, limite OMS: {WHO_limit_annual})")
-        plt.text(filtered_data['date'].iloc[450], 116, f"Media di PM2.5 nel 2024: {avg_2024:.2f} \n(limite UE: {UE_limit_annual}, limite OMS: {WHO_limit_annual})")
+        plt.text(label_date(filtered_data, 450), 108, f"Media di PM2.5 nel 2023: {avg.get(2023, np.nan):.2f} \n(limite UE: {UE_limit_annual}, limite OMS: {WHO_limit_annual})")
+        plt.text(label_date(filtered_data, 450), 116, f"Media di PM2.5 nel 2024: {avg.get(2024, np.nan):.2f} \n(limite UE: {UE_limit_annual}, limite OMS: {WHO_limit_annual})")
 
     plt.yticks(range(0, int(filtered_data['Valore'].max()) + 5, 5))
-    plt.xticks(filtered_data['date'], rotation=45, ha='right', fontsize=8)
-    plt.gca().xaxis.set_major_locator(mdates.MonthLocator(bymonth=range(1, 13, 1)))
-    plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%m-%Y'))
+    # month ticks set directly on the axis (not one tick per data point)
+    format_date_axis(plt.gca(), start_date, end_date)
+    plt.xticks(rotation=45, ha='right', fontsize=8)
 
     legend = plt.legend(frameon=False, loc='upper left')
     for line in legend.get_lines():
         line.set_linewidth(4)
 
-    plt.style.use('seaborn-white')
+    plt.style.use(PLOT_STYLE)
     plt.tick_params(axis='x', direction='out', length=4, width=1, colors='black')
 
     plt.xlabel('')
@@ -612,4 +1297,66 @@ def plot_air_quality_pm10_lombardia(data, city, start_date, end_date, save=False
     plt.title(f'Inquinamento PM10 in {city} ({start_date} - {end_date})', pad=10)
 
     if save==False:
-        plt.show()
\ No newline at end of file
+        plt.show()
+
+
+# plot function for each (pollutant, region) chart
+PLOT_FUNCTIONS = {
+    ('pm25', 'milan'): plot_air_quality_25_milan,
+    ('pm10', 'milan'): plot_air_quality_pm10_milan,
+    ('pm25', 'lombardia'): plot_air_quality_25_lombardia,
+    ('pm10', 'lombardia'): plot_air_quality_pm10_lombardia,
+}
+# name shown in the chart title for each region
+REGION_NAMES = {'milan': 'Milano', 'lombardia': 'Lombardia'}
+# every limit drawn or counted by the plot functions, so one stats table serves all of them
+CHART_THRESHOLDS = [15, 25, 45, 50, 90]
+
+# Function to give a chart its file label: the year for single-year charts, 'all_dates' otherwise
+def _chart_label(start_date, end_date):
+    start_date, end_date = pd.to_datetime(start_date), pd.to_datetime(end_date)
+    return str(start_date.year) if start_date.year == end_date.year else 'all_dates'
+
+# Function run in each worker process before rendering: charts are only written to files
+def _init_render_worker():
+    plt.switch_backend('Agg')
+
+# Function to render one chart to an SVG file (runs in a worker process)
+@profiled
+def _render_chart(job):
+    pollutant, region, daily, stats, start_date, end_date, annotation, max_points, filepath = job
+    PLOT_FUNCTIONS[pollutant, region](daily, REGION_NAMES[region], start_date, end_date,
+                                      save=True, annotation=annotation, stats=stats, max_points=max_points)
+    with stage('savefig'):
+        plt.savefig(filepath, format='svg', dpi=300, facecolor='w', bbox_inches='tight')
+    plt.close('all')
+    return filepath
+
+# Function to render many charts in parallel worker processes
+#   daily: tidy daily means with a 'group' column named '<pollutant>_<region>' (e.g. from aggregate_station_groups)
+#   specs: (pollutant, region, start_date, end_date, annotation) tuples, optionally followed by a file label
+@profiled
+def render_charts(daily, specs, out_dir='./plots', processes=None, max_points=None):
+    os.makedirs(out_dir, exist_ok=True)
+    # sort once and compute the yearly statistics once per group, then share them between charts
+    daily = daily.sort_values(['group', 'date'])
+    groups = {group: frame[['date', 'Valore']].reset_index(drop=True) for group, frame in daily.groupby('group')}
+    stats = {group: exceedance_stats(frame, CHART_THRESHOLDS) for group, frame in groups.items()}
+
+    jobs = []
+    for spec in specs:
+        pollutant, region, start_date, end_date, annotation = spec[:5]
+        label = spec[5] if len(spec) > 5 else _chart_label(start_date, end_date)
+        group = f'{pollutant}_{region}'
+        filepath = os.path.join(out_dir, f'air_quality_{pollutant}_{region}_{label}.svg')
+        jobs.append((pollutant, region, groups[group], stats[group], start_date, end_date, annotation, max_points, filepath))
+
+    if processes == 1:
+        backend = plt.get_backend()
+        _init_render_worker()
+        try:
+            return [_render_chart(job) for job in jobs]
+        finally:
+            plt.switch_backend(backend)
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_render_worker) as pool:
+        return list(pool.map(_render_chart, jobs))
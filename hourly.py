@@ -0,0 +1,165 @@
+import numpy as np
+import pandas as pd
+
+from functions import add_timestamps, valid_values
+
+# Hour-of-day x weekday x month profiles of the hourly readings, for every sensor and station group.
+# Every reading gets one integer cell code (month, weekday, hour), and every sensor/group a row, so a
+# profile statistic is a single np.bincount over the flat index row * CELLS + cell instead of a groupby.
+# Counts, sums and exceedance counts are additive: a ProfileAccumulator can be fed new readings as they
+# arrive and group profiles are the sums of their sensors' rows. Percentiles need the readings themselves
+# and are computed in one sort of the flat index (profile_percentiles).
+
+HOURS, WEEKDAYS, MONTHS = 24, 7, 12
+# profile cells per sensor or group
+CELLS = HOURS * WEEKDAYS * MONTHS
+
+
+# Function to give every timestamp its profile cell: (month - 1) * 168 + weekday * 24 + hour
+def profile_cells(timestamps):
+    timestamps = pd.DatetimeIndex(timestamps)
+    return ((timestamps.month.to_numpy() - 1) * (WEEKDAYS * HOURS) + timestamps.weekday.to_numpy() * HOURS
+            + timestamps.hour.to_numpy()).astype('int64')
+
+# Function to lay per-cell arrays out as a tidy frame with 'month', 'weekday' (0 = Monday) and 'hour'
+def _cell_frame(values, keys, key_name):
+    cells = np.arange(CELLS)
+    frame = pd.DataFrame({
+        key_name: np.repeat(keys, CELLS),
+        'month': np.tile(cells // (WEEKDAYS * HOURS) + 1, len(keys)),
+        'weekday': np.tile(cells // HOURS % WEEKDAYS, len(keys)),
+        'hour': np.tile(cells % HOURS, len(keys)),
+    })
+    for name, array in values.items():
+        frame[name] = array.ravel()
+    return frame
+
+# Function to get the valid readings of a frame with their sensor IDs and profile cells
+def _valid_readings(data, sensors=None):
+    add_timestamps(data)
+    values = valid_values(data, days=False).to_numpy(dtype='float64')
+    keep = ~np.isnan(values) & data['timestamp'].notna().to_numpy()
+    if sensors is not None:
+        keep &= np.isin(data['IdSensore'].to_numpy(), np.asarray(list(sensors)))
+    timestamps = data['timestamp'].to_numpy()[keep]
+    return data['IdSensore'].to_numpy()[keep].astype('int64'), profile_cells(timestamps), values[keep]
+
+# Function to build the 0/1 membership matrix of named station groups (groups x sensors)
+def _membership(groups, sensor_ids):
+    matrix = np.zeros((len(groups), len(sensor_ids)))
+    for i, group_sensors in enumerate(groups.values()):
+        matrix[i, np.isin(sensor_ids, np.asarray(list(group_sensors)))] = 1.0
+    return matrix
+
+
+# Incremental per-sensor profile accumulator: counts, sums and exceedance counts per profile cell
+#   thresholds: hourly readings above each threshold are counted for the exceedance rates
+class ProfileAccumulator:
+    def __init__(self, thresholds=()):
+        self.thresholds = list(thresholds)
+        self.sensor_ids = np.array([], dtype='int64')
+        self.count = np.zeros((0, CELLS), dtype='int64')
+        self.sum = np.zeros((0, CELLS))
+        self.above = {threshold: np.zeros((0, CELLS), dtype='int64') for threshold in self.thresholds}
+
+    # Function to add rows for sensors seen for the first time, keeping the sensor IDs sorted
+    def _add_sensors(self, sensors):
+        new = np.setdiff1d(sensors, self.sensor_ids)
+        if not len(new):
+            return
+        sensor_ids = np.union1d(self.sensor_ids, new)
+        rows = np.searchsorted(sensor_ids, self.sensor_ids)
+
+        def grow(array):
+            grown = np.zeros((len(sensor_ids), CELLS), dtype=array.dtype)
+            grown[rows] = array
+            return grown
+
+        self.count, self.sum = grow(self.count), grow(self.sum)
+        self.above = {threshold: grow(array) for threshold, array in self.above.items()}
+        self.sensor_ids = sensor_ids
+
+    # Function to add new readings (any sensor frame; -9999 and readings failing quality_check are skipped)
+    def update(self, data, sensors=None):
+        sensor_ids, cells, values = _valid_readings(data, sensors)
+        self._add_sensors(np.unique(sensor_ids))
+        flat = np.searchsorted(self.sensor_ids, sensor_ids) * CELLS + cells
+        size = len(self.sensor_ids) * CELLS
+        self.count += np.bincount(flat, minlength=size).reshape(self.count.shape)
+        self.sum += np.bincount(flat, weights=values, minlength=size).reshape(self.sum.shape)
+        for threshold in self.thresholds:
+            self.above[threshold] += np.bincount(flat[values > threshold], minlength=size).reshape(self.count.shape)
+        return self
+
+    # Function to get the profiles as a tidy frame, one row per sensor (or group) and cell
+    #   groups: named station groups whose readings are pooled, instead of per-sensor profiles
+    def profiles(self, groups=None):
+        count, total, above = self.count, self.sum, self.above
+        keys, key_name = self.sensor_ids, 'IdSensore'
+        if groups is not None:
+            membership = _membership(groups, self.sensor_ids)
+            count = (membership @ count).astype('int64')
+            total = membership @ total
+            above = {threshold: (membership @ array).astype('int64') for threshold, array in above.items()}
+            keys, key_name = np.asarray(list(groups)), 'group'
+        with np.errstate(invalid='ignore', divide='ignore'):
+            values = {'n': count, 'mean': total / count}
+            for threshold, array in above.items():
+                values[f'rate_above_{threshold:g}'] = array / count
+        return _cell_frame(values, keys, key_name)
+
+
+# Function to compute per-cell percentiles of the readings (linear interpolation, as np.percentile)
+#   groups: named station groups whose readings are pooled, instead of per-sensor percentiles
+def profile_percentiles(data, percentiles=(50, 90, 98), sensors=None, groups=None):
+    sensor_ids, cells, values = _valid_readings(data, sensors)
+    if groups is None:
+        keys, key_name = np.unique(sensor_ids), 'IdSensore'
+        flat = np.searchsorted(keys, sensor_ids) * CELLS + cells
+    else:
+        keys, key_name = np.asarray(list(groups)), 'group'
+        # a reading counts once for every group its sensor belongs to
+        selected = [np.isin(sensor_ids, np.asarray(list(group_sensors))) for group_sensors in groups.values()]
+        # the empty arrays keep np.concatenate working when there are no groups
+        flat = np.concatenate([np.zeros(0, dtype='int64')] + [i * CELLS + cells[mask] for i, mask in enumerate(selected)])
+        values = np.concatenate([np.zeros(0)] + [values[mask] for mask in selected])
+    size = len(keys) * CELLS
+    # sort by cell, then by value within each cell
+    order = np.lexsort((values, flat))
+    values = values[order]
+    counts = np.bincount(flat, minlength=size)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    result = {}
+    with np.errstate(invalid='ignore'):
+        for q in percentiles:
+            position = starts + (counts - 1) * q / 100.0
+            lower = np.floor(position).astype('int64')
+            upper = np.ceil(position).astype('int64')
+            empty = counts == 0
+            lower[empty] = upper[empty] = 0
+            if len(values):
+                quantile = values[lower] + (values[upper] - values[lower]) * (position - lower)
+            else:
+                quantile = np.zeros(size)
+            quantile[empty] = np.nan
+            result[f'p{q:g}'] = quantile.reshape(len(keys), CELLS)
+    return _cell_frame(result, keys, key_name)
+
+# Function to compute full hour x weekday x month profiles (count, mean, exceedance rates, percentiles)
+# for every sensor, and for the named station groups if given
+#   returns (sensor profiles, group profiles or None)
+def hourly_profiles(data, sensors=None, groups=None, thresholds=(), percentiles=(50, 90, 98)):
+    if sensors is None and groups:
+        sensors = sorted({sensor for group_sensors in groups.values() for sensor in group_sensors})
+    accumulator = ProfileAccumulator(thresholds).update(data, sensors)
+    keys = ['IdSensore', 'month', 'weekday', 'hour']
+    sensor_profiles = accumulator.profiles()
+    if percentiles:
+        sensor_profiles = sensor_profiles.merge(profile_percentiles(data, percentiles, sensors), on=keys, how='left')
+    if groups is None:
+        return sensor_profiles, None
+    keys[0] = 'group'
+    group_profiles = accumulator.profiles(groups)
+    if percentiles:
+        group_profiles = group_profiles.merge(profile_percentiles(data, percentiles, sensors, groups), on=keys, how='left')
+    return sensor_profiles, group_profiles
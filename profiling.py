@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import functools
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+# Opt-in stage-level instrumentation for the analysis pipeline.
+# Functions decorated with @profiled, and blocks wrapped in `with stage(...)`, record wall time, CPU time,
+# rows in/out and peak traced memory while a `with profile() as run:` block is active; stages nest, and
+# run.summary() / run.write_trace(path) export a table and a Chrome trace (chrome://tracing, Perfetto).
+# Outside of profile() the decorator and stage() only check a flag, so the overhead is negligible.
+# Peak memory is only recorded for stages of the thread that opened profile(): tracemalloc keeps one
+# process-wide peak, so those peaks include allocations made meanwhile by other threads, and stages of
+# other threads (which would reset each other's peaks) report no peak_mb. Functions handed to a thread pool
+# can be wrapped with carry_stage() so that their stages nest under the stage that submitted them.
+#
+#   with profile() as run:
+#       calculate_sensor_avg(data, pm_stations)
+#   run.summary()
+#   run.write_trace('trace.json')
+
+# the active profile run, None when instrumentation is off
+_active = None
+
+
+# Function to count the rows of a DataFrame/Series argument or result (the last frame of a tuple)
+def _rows(value):
+    if isinstance(value, tuple):
+        frames = [item for item in value if isinstance(item, (pd.DataFrame, pd.Series))]
+        value = frames[-1] if frames else None
+    return len(value) if isinstance(value, (pd.DataFrame, pd.Series)) else None
+
+
+# One profiling run: the recorded stages and their export
+class ProfileRun:
+    def __init__(self, memory=True):
+        self.memory = memory
+        self.records = []
+        self.start = time.perf_counter()
+        self._local = threading.local()
+        # the only thread whose stages measure memory
+        self.thread = threading.get_ident()
+
+    # stack of open stages of the current thread
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def enter(self, name, rows_in=None):
+        stack = self._stack()
+        # the first stage of a pool thread nests under the stage carried over by carry_stage()
+        parent = stack[-1]['record'] if stack else getattr(self._local, 'parent', None)
+        record = {
+            'stage': name,
+            'parent': parent['stage'] if parent else None,
+            'depth': parent['depth'] + 1 if parent else 0,
+            'thread': threading.get_ident(),
+            'rows_in': rows_in,
+            'rows_out': None,
+        }
+        frame = {'record': record, 'child_peak': 0, 'memory': self.memory and record['thread'] == self.thread}
+        if frame['memory']:
+            current, peak = tracemalloc.get_traced_memory()
+            # the peak reached so far by the enclosing stage is kept here, since reset_peak() forgets it
+            frame['outer_peak'] = peak
+            frame['start_memory'] = current
+            tracemalloc.reset_peak()
+        frame['wall'] = time.perf_counter()
+        frame['cpu'] = time.process_time()
+        stack.append(frame)
+        return record
+
+    def exit(self):
+        frame = self._stack().pop()
+        wall, cpu = time.perf_counter(), time.process_time()
+        record = frame['record']
+        record['start'] = frame['wall'] - self.start
+        record['wall'] = wall - frame['wall']
+        record['cpu'] = cpu - frame['cpu']
+        if frame['memory']:
+            peak = max(tracemalloc.get_traced_memory()[1], frame['child_peak'])
+            record['peak_mb'] = (peak - frame['start_memory']) / 2**20
+            # hand the peak up to the enclosing stage
+            stack = self._stack()
+            if stack:
+                stack[-1]['child_peak'] = max(stack[-1]['child_peak'], peak, frame['outer_peak'])
+        self.records.append(record)
+
+    # Function to summarise the run: one row per stage with calls, total wall/CPU time, rows and peak memory
+    def summary(self):
+        if not self.records:
+            return pd.DataFrame()
+        records = pd.DataFrame(self.records)
+        # stages that do not report rows stay missing rather than summing to 0
+        total = lambda values: values.sum(min_count=1)
+        columns = {'calls': ('wall', 'size'), 'wall': ('wall', 'sum'), 'cpu': ('cpu', 'sum'),
+                   'rows_in': ('rows_in', total), 'rows_out': ('rows_out', total)}
+        if 'peak_mb' in records:
+            columns['peak_mb'] = ('peak_mb', 'max')
+        summary = records.groupby('stage', sort=False).agg(**columns)
+        return summary.sort_values('wall', ascending=False)
+
+    # Function to write the run as a Chrome trace event file
+    def write_trace(self, path):
+        events = []
+        for record in self.records:
+            args = {key: record[key] for key in ('rows_in', 'rows_out', 'cpu', 'peak_mb') if record.get(key) is not None}
+            events.append({
+                'name': record['stage'],
+                'ph': 'X',
+                'ts': record['start'] * 1e6,
+                'dur': record['wall'] * 1e6,
+                'pid': os.getpid(),
+                'tid': record['thread'],
+                'args': args,
+            })
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+# Function to turn instrumentation on for the duration of a with block
+#   memory: also record peak memory per stage (tracemalloc, which slows allocations down)
+@contextmanager
+def profile(memory=True, trace_path=None):
+    global _active
+    previous = _active
+    run = ProfileRun(memory)
+    started_tracing = memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    _active = run
+    try:
+        yield run
+    finally:
+        _active = previous
+        if started_tracing:
+            tracemalloc.stop()
+        if trace_path is not None:
+            run.write_trace(trace_path)
+
+# Function to record a block as a stage; set record['rows_out'] on the yielded dict to report output rows
+@contextmanager
+def stage(name, rows_in=None):
+    run = _active
+    if run is None:
+        yield {}
+        return
+    record = run.enter(name, rows_in)
+    try:
+        yield record
+    finally:
+        run.exit()
+
+# Function to wrap a function run in a pool thread, so that its stages nest under the caller's open stage
+def carry_stage(func):
+    run = _active
+    if run is None:
+        return func
+    stack = run._stack()
+    parent = stack[-1]['record'] if stack else None
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = getattr(run._local, 'parent', None)
+        run._local.parent = parent
+        try:
+            return func(*args, **kwargs)
+        finally:
+            run._local.parent = previous
+    return wrapper
+
+# Decorator recording every call of a function as a stage named after it
+def profiled(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        run = _active
+        if run is None:
+            return func(*args, **kwargs)
+        record = run.enter(func.__name__, _rows(args[0]) if args else None)
+        try:
+            result = func(*args, **kwargs)
+            record['rows_out'] = _rows(result)
+            return result
+        finally:
+            run.exit()
+    return wrapper
@@ -0,0 +1,307 @@
+import os
+import re
+import sys
+import glob
+import json
+import time
+import pickle
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+# Command-line version of air-pollution-graphs.ipynb, run as a graph of cached stages:
+#   load -> clean -> aggregate (per snapshot) -> merge -> stats -> plot / export
+# Every stage has a key made from its parameters, the keys of its inputs and the code, and source files
+# are fingerprinted by content. A stage only runs when no output is cached for its key (or its output files
+# are gone); independent stages run concurrently, charts in worker processes. pandas and functions.py are
+# only imported by the stages that actually run, so a refresh where nothing changed returns immediately.
+#
+#   python report.py                      # all ./data/Dati_sensori_aria_*.csv snapshots
+#   python report.py --snapshots data/Dati_sensori_aria_20240220.csv data/Dati_sensori_aria_20250121.csv
+
+REPORT_CACHE_DIR = './data/cache/report'
+PLOTS_DIR = './plots'
+EXPORT_DIR = './data/data_export'
+STATIONS_PATH = './data/Stazioni_qualit__dell_aria_20240219.csv'
+SNAPSHOT_PATTERN = './data/Dati_sensori_aria_*.csv'
+
+# charts drawn for each station group, and the groups exported as CSV
+CHART_GROUPS = [('pm25', 'milan'), ('pm25', 'lombardia'), ('pm10', 'milan'), ('pm10', 'lombardia')]
+EXPORT_GROUPS = CHART_GROUPS + [('no2', 'lombardia')]
+# file name prefixes used by the notebook's exports
+EXPORT_NAMES = {'no2': 'NO2'}
+
+# source files whose changes invalidate every cached stage
+CODE_FILES = ['functions.py', 'profiling.py', 'report.py']
+
+
+# One node of the pipeline graph
+#   func(*outputs of deps, **params) computes the stage's output
+#   persist: cache the output on disk (stages that are cheap to redo, like loading, are not)
+#   outputs: files the stage writes, re-run if any of them is missing
+#   process: run in a worker process instead of a thread (charts: pyplot is not thread-safe)
+class Stage:
+    def __init__(self, name, func, deps=(), params=None, persist=True, outputs=(), process=False):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.params = params or {}
+        self.persist = persist
+        self.outputs = list(outputs)
+        self.process = process
+
+
+# Function to fingerprint a file by content, rehashing only when its size or modification time changed
+def file_fingerprint(path, cache_dir=REPORT_CACHE_DIR):
+    index_path = os.path.join(cache_dir, 'fingerprints.json')
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        index = {}
+    stat = os.stat(path)
+    entry = index.get(os.path.abspath(path))
+    if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+        return entry['hash']
+    from functions import file_hash
+    entry = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': file_hash(path)}
+    index[os.path.abspath(path)] = entry
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(index_path + '.tmp', 'w') as f:
+        json.dump(index, f)
+    os.replace(index_path + '.tmp', index_path)
+    return entry['hash']
+
+# Function to hash the code the stages run, so that editing it invalidates the cache
+def code_version():
+    digest = hashlib.sha256()
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in CODE_FILES:
+        with open(os.path.join(here, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+# Function to compute the cache key of every stage from its parameters, its inputs' keys and the code
+def stage_keys(stages, code):
+    keys = {}
+    for stage in stages:
+        payload = json.dumps([stage.name, stage.params, [keys[dep] for dep in stage.deps], code],
+                             sort_keys=True, default=str)
+        keys[stage.name] = hashlib.sha256(payload.encode()).hexdigest()[:20]
+    return keys
+
+# Function to give the cache file of a stage output
+def _cache_path(cache_dir, name, key):
+    return os.path.join(cache_dir, re.sub(r'[^\w.-]', '_', name) + f'-{key}.pkl')
+
+# Function to run the stages that are out of date, concurrently where the graph allows
+#   stages must be listed with every stage after its dependencies
+def run_stages(stages, cache_dir=REPORT_CACHE_DIR, jobs=None, force=False, log=print):
+    by_name = {stage.name: stage for stage in stages}
+    keys = stage_keys(stages, code_version())
+
+    # persisted stages with no cached output (or with missing output files) are out of date
+    stale = set()
+    for stage in stages:
+        if not stage.persist:
+            continue
+        cached = os.path.exists(_cache_path(cache_dir, stage.name, keys[stage.name]))
+        if force or not cached or not all(os.path.exists(path) for path in stage.outputs):
+            stale.add(stage.name)
+    # uncached stages only run when a stage that runs needs them
+    to_run = set(stale)
+    for stage in reversed(stages):
+        if stage.name in to_run:
+            to_run.update(dep for dep in stage.deps if not by_name[dep].persist)
+
+    if not to_run:
+        log(f'report: {len(stages)} stages up to date')
+        return {}
+
+    os.makedirs(cache_dir, exist_ok=True)
+    results = {}
+
+    def value(name):
+        if name not in results:
+            with open(_cache_path(cache_dir, name, keys[name]), 'rb') as f:
+                results[name] = pickle.load(f)
+        return results[name]
+
+    def save(stage, output):
+        path = _cache_path(cache_dir, stage.name, keys[stage.name])
+        # drop outputs cached for earlier keys of the same stage
+        prefix = os.path.basename(path).rsplit('-', 1)[0] + '-'
+        for entry in os.listdir(cache_dir):
+            if entry.startswith(prefix) and entry.endswith('.pkl'):
+                os.remove(os.path.join(cache_dir, entry))
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(output, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    started = time.perf_counter()
+    pending = [stage for stage in stages if stage.name in to_run]
+    running = {}
+    with ThreadPoolExecutor(max_workers=jobs) as threads, ProcessPoolExecutor(max_workers=jobs) as processes:
+        while pending or running:
+            # submit every stage whose inputs are ready
+            for stage in list(pending):
+                if any(dep in to_run and dep not in results for dep in stage.deps):
+                    continue
+                pending.remove(stage)
+                inputs = [value(dep) for dep in stage.deps]
+                pool = processes if stage.process else threads
+                running[pool.submit(stage.func, *inputs, **stage.params)] = stage
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                results[stage.name] = future.result()
+                if stage.persist:
+                    save(stage, results[stage.name])
+                log(f'report: ran {stage.name}')
+    log(f'report: ran {len(to_run)} of {len(stages)} stages in {time.perf_counter() - started:.1f}s')
+    return results
+
+
+# Function to load a snapshot (parsed once into the snapshot cache)
+def _load(path, fingerprint, cache_dir):
+    from functions import load_sensor_data_cached
+    return load_sensor_data_cached(path, cache_dir)
+
+# Function to clean a snapshot: compact dtypes, -9999 recoded to NA
+def _clean(data):
+    from functions import compact_observations
+    return compact_observations(data)
+
+# Function to build the named station groups from the station list
+def _groups(path, fingerprint, cache_dir):
+    from functions import load_station_data_cached, station_groups
+    return station_groups(load_station_data_cached(path, cache_dir))
+
+# Function to compute per-sensor daily sums for every sensor used by the groups
+def _aggregate(data, groups):
+    from functions import sensor_daily_sums
+    sensors = sorted({sensor for group_sensors in groups.values() for sensor in group_sensors})
+    return sensor_daily_sums(data, sensors)
+
+# Function to merge the snapshots' daily sums (the newest snapshot wins for every sensor and day)
+# and reduce them to daily and yearly means per group
+def _merge(groups, *sums):
+    import pandas as pd
+    from functions import reduce_station_groups
+    sums = pd.concat(sums, ignore_index=True).drop_duplicates(['IdSensore', 'date'], keep='last')
+    return reduce_station_groups(sums, groups)
+
+# Function to compute the yearly statistics used by the chart annotations
+def _stats(merged):
+    from functions import exceedance_stats, CHART_THRESHOLDS
+    return exceedance_stats(merged[0], CHART_THRESHOLDS, by=['group'])
+
+# Function to render one chart (runs in a worker process)
+def _plot(merged, stats, pollutant, region, start_date, end_date, annotation, filepath):
+    from functions import _init_render_worker, _render_chart
+    _init_render_worker()
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    group = f'{pollutant}_{region}'
+    daily = merged[0]
+    daily = daily.loc[daily['group'] == group, ['date', 'Valore']].reset_index(drop=True)
+    stats = stats[stats['group'] == group].drop(columns='group')
+    return _render_chart((pollutant, region, daily, stats, start_date, end_date, annotation, None, filepath))
+
+# Function to export the daily means of a group over a period as CSV
+def _export(merged, group, start_date, end_date, filepath):
+    import pandas as pd
+    from functions import filter_dates
+    daily = merged[0]
+    daily = daily.loc[daily['group'] == group, ['date', 'Valore']]
+    daily = filter_dates(daily, pd.to_datetime(start_date).date(), pd.to_datetime(end_date).date())
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    daily.to_csv(filepath, index=False)
+    return filepath
+
+# Function to export the yearly means of every group as CSV
+def _export_yearly(merged, filepath):
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    merged[1].to_csv(filepath, index=False)
+    return filepath
+
+
+# Function to get the download date of a snapshot from its file name (Dati_sensori_aria_YYYYMMDD.csv)
+def snapshot_date(path):
+    match = re.search(r'(\d{4})(\d{2})(\d{2})', os.path.basename(path))
+    return '-'.join(match.groups()) if match else None
+
+# Function to build the report's stage graph
+#   snapshots: ARPA sensor dumps, oldest first (newer snapshots win where they overlap)
+#   end_date: last day of the charts and exports (default: download date of the newest snapshot)
+def build_report_stages(snapshots, stations_path=STATIONS_PATH, start_date='2023-01-01', end_date=None,
+                        plots_dir=PLOTS_DIR, export_dir=EXPORT_DIR, cache_dir=REPORT_CACHE_DIR):
+    end_date = end_date or snapshot_date(snapshots[-1]) or time.strftime('%Y-%m-%d')
+    # parsed snapshots are cached with the report's stage outputs
+    snapshot_cache_dir = os.path.join(cache_dir, 'snapshots')
+    stages = [Stage('groups', _groups, params={'path': stations_path,
+                                              'fingerprint': file_fingerprint(stations_path, cache_dir),
+                                              'cache_dir': snapshot_cache_dir})]
+    aggregates = []
+    for path in snapshots:
+        name = os.path.splitext(os.path.basename(path))[0]
+        stages += [
+            Stage(f'load:{name}', _load, params={'path': path, 'fingerprint': file_fingerprint(path, cache_dir),
+                                                 'cache_dir': snapshot_cache_dir},
+                  persist=False),
+            Stage(f'clean:{name}', _clean, deps=[f'load:{name}'], persist=False),
+            Stage(f'aggregate:{name}', _aggregate, deps=[f'clean:{name}', 'groups']),
+        ]
+        aggregates.append(f'aggregate:{name}')
+    stages += [
+        Stage('merge', _merge, deps=['groups'] + aggregates),
+        Stage('stats', _stats, deps=['merge']),
+    ]
+
+    # one chart and one export for the whole period, then one per complete calendar year
+    first_year, last_year = int(start_date[:4]), int(end_date[:4])
+    periods = [('all_dates', start_date, end_date, True)]
+    periods += [(str(year), f'{year}-01-01', f'{year}-12-31', False)
+                for year in range(first_year, last_year + 1) if f'{year}-12-31' <= end_date]
+    for label, period_start, period_end, annotation in periods:
+        for pollutant, region in CHART_GROUPS:
+            filepath = os.path.join(plots_dir, f'air_quality_{pollutant}_{region}_{label}.svg')
+            stages.append(Stage(f'plot:{pollutant}_{region}_{label}', _plot, deps=['merge', 'stats'],
+                                params={'pollutant': pollutant, 'region': region, 'start_date': period_start,
+                                        'end_date': period_end, 'annotation': annotation, 'filepath': filepath},
+                                outputs=[filepath], process=True))
+        for pollutant, region in EXPORT_GROUPS:
+            label_name = 'all' if label == 'all_dates' else label
+            filepath = os.path.join(export_dir, f'{EXPORT_NAMES.get(pollutant, pollutant)}_{region}_{label_name}.csv')
+            stages.append(Stage(f'export:{pollutant}_{region}_{label_name}', _export, deps=['merge'],
+                                params={'group': f'{pollutant}_{region}', 'start_date': period_start,
+                                        'end_date': period_end, 'filepath': filepath},
+                                outputs=[filepath]))
+    filepath = os.path.join(export_dir, 'annual_means.csv')
+    stages.append(Stage('export:annual_means', _export_yearly, deps=['merge'], params={'filepath': filepath},
+                        outputs=[filepath]))
+    return stages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build the air pollution report (charts and CSV exports).')
+    parser.add_argument('--snapshots', nargs='+', help='ARPA sensor dumps, oldest first '
+                        f'(default: {SNAPSHOT_PATTERN} sorted by name)')
+    parser.add_argument('--stations', default=STATIONS_PATH, help='ARPA station list')
+    parser.add_argument('--start-date', default='2023-01-01', help='first day of the report (YYYY-MM-DD)')
+    parser.add_argument('--end-date', help='last day of the report (default: date of the newest snapshot)')
+    parser.add_argument('--plots-dir', default=PLOTS_DIR)
+    parser.add_argument('--export-dir', default=EXPORT_DIR)
+    parser.add_argument('--cache-dir', default=REPORT_CACHE_DIR)
+    parser.add_argument('--jobs', type=int, help='stages run at the same time (default: CPU count)')
+    parser.add_argument('--force', action='store_true', help='re-run every stage')
+    args = parser.parse_args(argv)
+
+    snapshots = args.snapshots or sorted(glob.glob(SNAPSHOT_PATTERN))
+    if not snapshots:
+        parser.error('no ARPA snapshots found')
+    stages = build_report_stages(snapshots, args.stations, args.start_date, args.end_date,
+                                 args.plots_dir, args.export_dir, args.cache_dir)
+    run_stages(stages, args.cache_dir, args.jobs, args.force)
+
+if __name__ == '__main__':
+    sys.exit(main())
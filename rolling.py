@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+
+from functions import sensor_time_matrix, sensor_daily_sums, sensor_day_matrices
+
+# Rolling and running-window air-quality metrics for every sensor at once.
+# All metrics work on dense sensor x time matrices (rows = sensors, columns = hours or days, NaN where a
+# reading is missing or was -9999) and are computed from cumulative sums along the time axis, so the cost
+# is a few array passes regardless of the number of sensors or the window length.
+
+
+# Function to compute cumulative sums of the valid values and of the number of valid values,
+# with a leading column of zeros so that window sums are differences of two columns
+def _cumulative(matrix):
+    valid = ~np.isnan(matrix)
+    sums = np.zeros((matrix.shape[0], matrix.shape[1] + 1))
+    counts = np.zeros((matrix.shape[0], matrix.shape[1] + 1), dtype='int64')
+    np.cumsum(np.where(valid, matrix, 0.0), axis=1, out=sums[:, 1:])
+    np.cumsum(valid, axis=1, out=counts[:, 1:])
+    return sums, counts
+
+# Function to compute the trailing mean over `window` columns ending at each column
+#   min_periods: minimum number of valid values in the window, NaN otherwise (default: the whole window)
+def rolling_mean(matrix, window, min_periods=None):
+    min_periods = window if min_periods is None else min_periods
+    sums, counts = _cumulative(matrix)
+    ends = np.arange(1, matrix.shape[1] + 1)
+    starts = np.maximum(ends - window, 0)
+    window_sums = sums[:, ends] - sums[:, starts]
+    window_counts = counts[:, ends] - counts[:, starts]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = window_sums / window_counts
+    means[window_counts < max(min_periods, 1)] = np.nan
+    return means
+
+# Function to compute the running mean from the first column of each calendar year to each column
+def running_year_mean(matrix, times):
+    sums, counts = _cumulative(matrix)
+    years = pd.DatetimeIndex(times).year.to_numpy()
+    # column where the year of each column starts
+    year_starts = np.flatnonzero(np.r_[True, years[1:] != years[:-1]])
+    starts = year_starts[np.searchsorted(year_starts, np.arange(len(years)), side='right') - 1]
+    ends = np.arange(1, len(years) + 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (sums[:, ends] - sums[:, starts]) / (counts[:, ends] - counts[:, starts])
+
+# Function to count, for each column, the days so far in the calendar year above a threshold
+def running_exceedance_count(matrix, times, threshold):
+    above = np.where(np.isnan(matrix), False, matrix > threshold)
+    counts = np.zeros((matrix.shape[0], matrix.shape[1] + 1), dtype='int64')
+    np.cumsum(above, axis=1, out=counts[:, 1:])
+    years = pd.DatetimeIndex(times).year.to_numpy()
+    year_starts = np.flatnonzero(np.r_[True, years[1:] != years[:-1]])
+    starts = year_starts[np.searchsorted(year_starts, np.arange(len(years)), side='right') - 1]
+    return counts[:, 1:] - counts[:, starts]
+
+# Function to compute the daily mean of every sensor as a sensor x day matrix
+def daily_mean_matrix(data, sensors=None, start_date=None, end_date=None):
+    sums = sensor_daily_sums(data, sensors)
+    sum_matrix, count_matrix, sensor_ids, days = sensor_day_matrices(sums, sensors, start_date, end_date)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sum_matrix / count_matrix, sensor_ids, days
+
+# Function to compute the standard set of rolling metrics for every sensor
+#   returns a dict of sensor x time DataFrames (rows = IdSensore)
+#   min_hours: hours needed for a valid rolling 24-hour mean (18 of 24 is the 75% rule)
+def rolling_metrics(data, sensors=None, thresholds=(), min_hours=18, windows=(7, 30)):
+    hourly, sensor_ids, hours = sensor_time_matrix(data, sensors)
+    daily, day_sensor_ids, days = daily_mean_matrix(data, sensors)
+
+    metrics = {
+        'rolling_24h_mean': pd.DataFrame(rolling_mean(hourly, 24, min_hours), index=sensor_ids, columns=hours),
+        'running_year_mean': pd.DataFrame(running_year_mean(hourly, hours), index=sensor_ids, columns=hours),
+    }
+    for window in windows:
+        # a moving average is valid when at least 75% of its days are
+        means = rolling_mean(daily, window, int(np.ceil(0.75 * window)))
+        metrics[f'moving_average_{window}d'] = pd.DataFrame(means, index=day_sensor_ids, columns=days)
+    for threshold in thresholds:
+        counts = running_exceedance_count(daily, days, threshold)
+        metrics[f'running_days_above_{threshold:g}'] = pd.DataFrame(counts, index=day_sensor_ids, columns=days)
+    return metrics
@@ -0,0 +1,183 @@
+import sys
+import json
+import argparse
+import functools
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+import pandas as pd
+
+from functions import CHART_THRESHOLDS, load_store_daily, load_station_registry, station_groups
+from cube import build_daily_cube, load_cube, save_cube, query_cube
+
+# Local HTTP/JSON query service over precomputed aggregates, for dashboards and ad-hoc questions.
+# Answers come from the sensor x day prefix-sum cube (cube.py), built from the observation store's
+# daily sums or loaded from a saved cube, so a query is a few array lookups; results are kept in an
+# LRU cache and requests are served concurrently. Everything is read from local files.
+#
+#   python server.py --store data/store --stations data/Stazioni_qualit__dell_aria_20240219.csv
+#   curl 'localhost:8000/query?group=pm25_milan&start=2024-01-01&end=2024-12-31&stat=days_above&threshold=15'
+#
+# Station sets: group=<name from station_groups> | sensors=<id>,<id>,... | pollutant=, province=, municipality=
+# Statistics:   stat=mean | daily_mean | days_above (threshold=, per=group|sensor) | annual_mean | valid_days
+
+STATIONS_PATH = './data/Stazioni_qualit__dell_aria_20240219.csv'
+STORE_DIR = './data/store'
+
+
+# Function to turn numpy results into JSON values (NaN becomes null)
+def _json_value(value):
+    if isinstance(value, np.ndarray):
+        return [_json_value(item) for item in value.tolist()]
+    if isinstance(value, (float, np.floating)):
+        return None if np.isnan(value) else float(value)
+    if isinstance(value, np.integer):
+        return int(value)
+    return value
+
+
+# Answers queries against one cube and station registry, caching the results
+class QueryService:
+    def __init__(self, cube, registry, cache_size=4096):
+        self.cube = cube
+        self.registry = registry
+        self.groups = station_groups(registry)
+        self.first_day = str(cube['days'][0]) if len(cube['days']) else None
+        self.last_day = str(cube['days'][-1]) if len(cube['days']) else None
+        # queries are normalised to hashable arguments before reaching the cache
+        self.answer = functools.lru_cache(maxsize=cache_size)(self._answer)
+
+    # Function to resolve the station set of a request to a sorted tuple of sensor IDs
+    def resolve_sensors(self, params):
+        if 'group' in params:
+            if params['group'] not in self.groups:
+                raise ValueError(f"unknown group: {params['group']} (known: {', '.join(sorted(self.groups))})")
+            sensors = self.groups[params['group']]
+        elif 'sensors' in params:
+            sensors = [int(sensor) for sensor in params['sensors'].split(',') if sensor]
+        elif any(name in params for name in ('pollutant', 'province', 'municipality')):
+            sensors = self.registry.sensors(params.get('pollutant'), params.get('province'), params.get('municipality'))
+        else:
+            raise ValueError('give a station set: group=, sensors= or pollutant= / province= / municipality=')
+        # repeated IDs would count a sensor several times in the cube lookups
+        return tuple(sorted({int(sensor) for sensor in sensors}))
+
+    # Function to compute the answer of a normalised query (cached through self.answer)
+    def _answer(self, sensors, start_date, end_date, stat, threshold, per):
+        if stat == 'annual_mean':
+            years = range(pd.Timestamp(start_date).year, pd.Timestamp(end_date).year + 1)
+            return {str(year): _json_value(query_cube(self.cube, sensors, max(start_date, f'{year}-01-01'),
+                                                      min(end_date, f'{year}-12-31'), 'mean'))
+                    for year in years}
+        if stat == 'days_above':
+            if threshold is None:
+                raise ValueError('stat=days_above needs threshold=')
+            if per == 'sensor':
+                values = query_cube(self.cube, sensors, start_date, end_date, 'days_above', threshold, per_sensor=True)
+                return dict(zip(map(str, self._present(sensors)), _json_value(values)))
+            return _json_value(query_cube(self.cube, sensors, start_date, end_date, 'days_above', threshold, group=True))
+        if stat in ('mean', 'daily_mean', 'valid_days'):
+            return _json_value(query_cube(self.cube, sensors, start_date, end_date, stat))
+        raise ValueError(f'unknown stat: {stat}')
+
+    # Function to keep the sensors that are in the cube, in the cube's order
+    def _present(self, sensors):
+        return np.intersect1d(self.cube['sensor_ids'], np.asarray(sensors, dtype='int64'))
+
+    # Function to answer the query string parameters of a /query request
+    def query(self, params):
+        sensors = self.resolve_sensors(params)
+        start_date = pd.Timestamp(params.get('start', self.first_day)).strftime('%Y-%m-%d')
+        end_date = pd.Timestamp(params.get('end', self.last_day)).strftime('%Y-%m-%d')
+        stat = params.get('stat', 'mean')
+        threshold = float(params['threshold']) if 'threshold' in params else None
+        per = params.get('per', 'group')
+        if per not in ('group', 'sensor'):
+            raise ValueError(f'unknown per: {per} (known: group, sensor)')
+        value = self.answer(sensors, start_date, end_date, stat, threshold, per)
+        return {
+            'stat': stat, 'threshold': threshold, 'start': start_date, 'end': end_date,
+            'sensors': len(self._present(sensors)), 'value': value,
+        }
+
+    # Function to list the sensors of a station set with their station names
+    def stations(self, params):
+        sensors = self.resolve_sensors(params)
+        names = self.registry.station_names(np.asarray(sensors))
+        return [{'IdSensore': sensor, 'NomeStazione': str(name)} for sensor, name in zip(sensors, names)]
+
+
+# Handles GET /query, /stations, /groups and /health with JSON responses
+class QueryHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            if url.path == '/query':
+                status, body = 200, self.service.query(params)
+            elif url.path == '/stations':
+                status, body = 200, self.service.stations(params)
+            elif url.path == '/groups':
+                status, body = 200, {group: len(sensors) for group, sensors in self.service.groups.items()}
+            elif url.path == '/health':
+                cache = self.service.answer.cache_info()
+                status, body = 200, {'first_day': self.service.first_day, 'last_day': self.service.last_day,
+                                     'sensors': len(self.service.cube['sensor_ids']),
+                                     'cache_hits': cache.hits, 'cache_misses': cache.misses}
+            else:
+                status, body = 404, {'error': f'unknown path: {url.path}'}
+        except (ValueError, KeyError) as e:
+            status, body = 400, {'error': str(e)}
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    # keep the console quiet, one line per request is too much for dashboards polling
+    def log_message(self, format, *args):
+        pass
+
+
+# Function to build the query cube from the observation store's per-sensor daily sums
+def store_cube(store_dir, thresholds=CHART_THRESHOLDS):
+    return build_daily_cube(load_store_daily(store_dir), thresholds)
+
+# Function to create the HTTP server (serve_forever() starts answering)
+def make_server(service, host='127.0.0.1', port=8000):
+    handler = type('Handler', (QueryHandler,), {'service': service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve air pollution aggregates as JSON over HTTP.')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--store', default=STORE_DIR, help='observation store to build the cube from')
+    source.add_argument('--cube', help='cube directory written by save_cube (or by --save-cube)')
+    parser.add_argument('--save-cube', help='write the cube built from --store here for faster restarts')
+    parser.add_argument('--stations', default=STATIONS_PATH, help='ARPA station list')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--cache-size', type=int, default=4096, help='query results kept in the LRU cache')
+    args = parser.parse_args(argv)
+
+    cube = load_cube(args.cube) if args.cube else store_cube(args.store)
+    if args.save_cube and not args.cube:
+        save_cube(cube, args.save_cube)
+    service = QueryService(cube, load_station_registry(args.stations), args.cache_size)
+    server = make_server(service, args.host, args.port)
+    print(f'serving {len(cube["sensor_ids"])} sensors, {service.first_day} to {service.last_day}, '
+          f'on http://{args.host}:{args.port}', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+
+from functions import sensor_daily_sums, sensor_day_matrices
+
+# Spatial interpolation of daily pollution fields from the station coordinates in the ARPA station
+# list ('lat' / 'lng' columns). The interpolation weights between every grid cell and every station are
+# computed once; the fields for all days are then a pair of matrix products, with each day's weights
+# renormalised over the stations that have a valid daily mean on that day.
+
+# mean Earth radius in km
+EARTH_RADIUS = 6371.0
+
+
+# Function to project lat/lng degrees onto a local plane in km (equirectangular around the mean latitude)
+def _project(lat, lng, lat0):
+    lat = np.radians(np.asarray(lat, dtype='float64'))
+    lng = np.radians(np.asarray(lng, dtype='float64'))
+    return np.column_stack([EARTH_RADIUS * lng * np.cos(np.radians(lat0)), EARTH_RADIUS * lat])
+
+# Function to compute the distance (km) between every grid cell and every station, in one broadcast
+def _distances(points, stations):
+    return np.sqrt(((points[:, None, :] - stations[None, :, :]) ** 2).sum(axis=2))
+
+# Function to build a regular lat/lng grid covering the stations, with the area of every cell in km²
+#   step: grid spacing in degrees
+#   max_distance: cells farther than this (km) from every station are left out of the region
+def station_grid(stations, step=0.05, max_distance=25.0):
+    lat, lng = stations['lat'].to_numpy(dtype='float64'), stations['lng'].to_numpy(dtype='float64')
+    grid_lat = np.arange(np.floor(lat.min() / step) * step, lat.max() + step, step)
+    grid_lng = np.arange(np.floor(lng.min() / step) * step, lng.max() + step, step)
+    cell_lat, cell_lng = [values.ravel() for values in np.meshgrid(grid_lat, grid_lng, indexing='ij')]
+    lat0 = lat.mean()
+    distances = _distances(_project(cell_lat, cell_lng, lat0), _project(lat, lng, lat0))
+    inside = distances.min(axis=1) <= max_distance
+    # cells shrink towards the poles with the cosine of the latitude
+    area = (np.radians(step) * EARTH_RADIUS) ** 2 * np.cos(np.radians(cell_lat))
+    return pd.DataFrame({'lat': cell_lat[inside], 'lng': cell_lng[inside], 'area': area[inside]})
+
+# Function to compute inverse-distance weights between every grid cell and every station
+#   power: IDW exponent; neighbours: keep only the k nearest stations of every cell (None keeps all)
+def idw_weights(grid, stations, power=2.0, neighbours=None):
+    lat0 = stations['lat'].mean()
+    points = _project(grid['lat'], grid['lng'], lat0)
+    station_points = _project(stations['lat'], stations['lng'], lat0)
+    distances = _distances(points, station_points)
+    # a cell on top of a station takes that station's value
+    weights = 1.0 / np.maximum(distances, 1e-6) ** power
+    if neighbours is not None and neighbours < weights.shape[1]:
+        nearest = np.argpartition(distances, neighbours - 1, axis=1)[:, :neighbours]
+        mask = np.zeros_like(weights, dtype=bool)
+        np.put_along_axis(mask, nearest, True, axis=1)
+        weights = np.where(mask, weights, 0.0)
+    return weights
+
+# Function to interpolate daily means onto the grid for all days at once
+#   daily: sensor x day matrix of daily means (NaN where missing), rows in the order of `stations`
+#   returns a cell x day matrix
+def interpolate_fields(daily, weights):
+    valid = ~np.isnan(daily)
+    # renormalise each day's weights over the stations with data that day
+    numerator = weights @ np.where(valid, daily, 0.0)
+    denominator = weights @ valid.astype('float64')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return numerator / denominator
+
+# Function to average gridded fields over the region, weighting every cell by its area
+def area_weighted_mean(fields, grid):
+    area = grid['area'].to_numpy()
+    valid = ~np.isnan(fields)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (np.where(valid, fields, 0.0) * area[:, None]).sum(axis=0) / (valid * area[:, None]).sum(axis=0)
+
+# Function to compute gridded daily fields and area-weighted regional daily means for a set of sensors
+#   map_data: ARPA station list with 'IdSensore', 'lat' and 'lng'
+#   returns (regional daily means as a 'date' / 'Valore' frame, cell x day fields, grid)
+def regional_fields(data, map_data, sensors, start_date=None, end_date=None, step=0.05, power=2.0,
+                    neighbours=None, max_distance=25.0):
+    stations = map_data[map_data['IdSensore'].isin(sensors)].dropna(subset=['lat', 'lng'])
+    stations = stations.drop_duplicates('IdSensore').sort_values('IdSensore')
+    sensor_ids = stations['IdSensore'].to_numpy()
+
+    sums = sensor_daily_sums(data, sensor_ids)
+    sum_matrix, count_matrix, _, days = sensor_day_matrices(sums, sensor_ids, start_date, end_date)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        daily = sum_matrix / count_matrix
+
+    grid = station_grid(stations, step, max_distance)
+    weights = idw_weights(grid, stations, power, neighbours)
+    fields = interpolate_fields(daily, weights)
+    regional = pd.DataFrame({'date': days.date, 'Valore': area_weighted_mean(fields, grid)})
+    return regional, fields, grid
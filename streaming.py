@@ -0,0 +1,212 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from functions import read_sensor_csv, parse_dates, valid_readings, load_station_registry, station_groups
+
+# Near-real-time ingestion of hourly ARPA files with threshold alerts.
+# A StreamMonitor keeps running daily sums and counts per sensor and per station group for the last few
+# days only; every new file updates them in time proportional to its rows (a re-sent reading replaces the
+# one it corrects), and an alert record is written as soon as a running daily mean crosses its pollutant's
+# threshold, and again once the day is over if the completed daily mean is above it.
+#
+#   python streaming.py --drop-dir data/incoming --alerts data/alerts.jsonl
+#
+# Files are picked up from the drop directory in name order and moved to its 'done' subdirectory;
+# writers should create them under a temporary name ('.tmp' / '.part' suffix) and rename when complete.
+
+# daily mean alarm thresholds in µg/m³ (the red lines of the plot functions)
+ALARM_THRESHOLDS = {'pm25': 50, 'pm10': 90}
+# days of readings and running means kept in memory
+RETENTION_DAYS = 3
+DROP_DIR = './data/incoming'
+ALERTS_PATH = './data/alerts.jsonl'
+STATIONS_PATH = './data/Stazioni_qualit__dell_aria_20240219.csv'
+
+NS_PER_DAY = 86_400 * 10**9
+
+
+# Running daily means and alerts over a stream of hourly readings
+#   groups: named station groups (station_groups); a group's pollutant is the part of its name before '_'
+#   thresholds: daily mean alarm threshold per pollutant
+#   retention_days: days kept before the newest day seen; older readings are dropped on arrival
+class StreamMonitor:
+    def __init__(self, groups, thresholds=ALARM_THRESHOLDS, retention_days=RETENTION_DAYS):
+        self.thresholds = dict(thresholds)
+        self.retention_days = retention_days
+        # the groups (and the pollutant) every sensor contributes to
+        self.sensor_groups = {}
+        self.sensor_pollutant = {}
+        for group, sensors in groups.items():
+            pollutant = group.split('_')[0]
+            for sensor in sensors:
+                self.sensor_groups.setdefault(int(sensor), []).append(group)
+                self.sensor_pollutant.setdefault(int(sensor), pollutant)
+        # everything is kept per day (days since 1970-01-01), so old days are dropped in one step:
+        #   readings: (sensor, hour in ns) -> value of the valid readings
+        #   totals: ('sensor' | 'group', key) -> [sum, count]
+        #   alerted: (kind, 'sensor' | 'group', key) of the alerts already emitted
+        self.readings = {}
+        self.totals = {}
+        self.alerted = {}
+        # newest day seen
+        self.newest_day = None
+        self.stats = {'rows': 0, 'late': 0, 'alerts': 0}
+
+    # Function to add a reading's value to its sensor-day and the days of its groups (sign -1 removes it)
+    def _apply(self, sensor, day, value, sign, touched):
+        day_totals = self.totals.setdefault(day, {})
+        for key in [('sensor', sensor)] + [('group', group) for group in self.sensor_groups.get(sensor, ())]:
+            totals = day_totals.setdefault(key, [0.0, 0])
+            totals[0] += sign * value
+            totals[1] += sign
+            touched.add((day,) + key)
+
+    # Function to ingest new readings (a frame with 'IdSensore', 'timestamp', 'Valore' and optionally 'Stato')
+    # and return the alert records they trigger
+    def update(self, data):
+        valid = valid_readings(data)
+        dated = data['timestamp'].notna().to_numpy()
+        days = data['timestamp'].to_numpy().astype('datetime64[ns]').astype('int64') // NS_PER_DAY
+        previous = self.newest_day
+        if dated.any() and (previous is None or days[dated].max() > previous):
+            self.newest_day = int(days[dated].max())
+        if self.newest_day is None:
+            return []
+        oldest_kept = self.newest_day - self.retention_days
+
+        touched = set()
+        hours = data['timestamp'].to_numpy().astype('datetime64[ns]').astype('int64')
+        rows = zip(data['IdSensore'].tolist(), hours.tolist(), days.tolist(), data['Valore'].tolist(),
+                   valid.tolist(), dated.tolist())
+        for sensor, hour, day, value, is_valid, is_dated in rows:
+            if not is_dated:
+                continue
+            if day < oldest_kept:
+                self.stats['late'] += 1
+                continue
+            day_readings = self.readings.setdefault(day, {})
+            old = day_readings.pop((sensor, hour), None)
+            if old is not None:
+                # a re-sent reading replaces the earlier one
+                self._apply(sensor, day, old, -1, touched)
+            if is_valid:
+                day_readings[sensor, hour] = value
+                self._apply(sensor, day, value, 1, touched)
+        self.stats['rows'] += len(data)
+
+        alerts = [self._alert('running', key) for key in sorted(touched, key=str)]
+        # days that ended with this file: check their completed means
+        if previous is not None and self.newest_day > previous:
+            for day in sorted(day for day in self.totals if previous <= day < self.newest_day):
+                alerts += [self._alert('completed', (day,) + key) for key in sorted(self.totals[day], key=str)]
+        self._evict()
+        alerts = [alert for alert in alerts if alert is not None]
+        self.stats['alerts'] += len(alerts)
+        return alerts
+
+    # Function to build the alert record for a day if its mean is above the threshold and not alerted yet
+    def _alert(self, kind, key):
+        day, level, name = key
+        pollutant = name.split('_')[0] if level == 'group' else self.sensor_pollutant.get(name)
+        threshold = self.thresholds.get(pollutant)
+        total, count = self.totals.get(day, {}).get((level, name), (0.0, 0))
+        day_alerted = self.alerted.setdefault(day, set())
+        if threshold is None or count == 0 or total / count <= threshold or (kind, level, name) in day_alerted:
+            return None
+        day_alerted.add((kind, level, name))
+        return {
+            'time': pd.Timestamp.now().isoformat(timespec='seconds'),
+            'kind': kind,
+            'level': level,
+            'key': name,
+            'pollutant': pollutant,
+            'date': str(np.datetime64(day, 'D')),
+            'mean': round(total / count, 2),
+            'hours': count,
+            'threshold': threshold,
+        }
+
+    # Function to drop the days older than the retention window
+    def _evict(self):
+        oldest_kept = self.newest_day - self.retention_days
+        for state in (self.readings, self.totals, self.alerted):
+            for day in [day for day in state if day < oldest_kept]:
+                del state[day]
+
+    # Function to return the current daily means as a frame (level, key, date, mean, hours)
+    def daily_means(self):
+        rows = [(level, name, np.datetime64(day, 'D'), total / count if count else np.nan, count)
+                for day, day_totals in self.totals.items() for (level, name), (total, count) in day_totals.items()]
+        return pd.DataFrame(rows, columns=['level', 'key', 'date', 'mean', 'hours'])
+
+
+# Function to read an hourly ARPA file (same columns as the sensor dumps) with parsed timestamps
+def read_hourly_file(path):
+    # 'Stato' is optional in hourly files
+    data = read_sensor_csv(path, required=False)
+    data['timestamp'] = parse_dates(data['Data'])
+    return data
+
+# Function to list the complete files waiting in the drop directory, in name order
+def _pending_files(drop_dir):
+    return sorted(entry.path for entry in os.scandir(drop_dir)
+                  if entry.is_file() and not entry.name.startswith('.')
+                  and not entry.name.endswith(('.tmp', '.part')))
+
+# Function to watch a drop directory, feed new files to the monitor and append alerts as JSON lines
+#   interval: seconds between polls of the directory; max_polls: stop after this many polls (None runs forever)
+def watch(monitor, drop_dir=DROP_DIR, alerts_path=ALERTS_PATH, interval=0.2, max_polls=None, log=None):
+    done_dir = os.path.join(drop_dir, 'done')
+    os.makedirs(done_dir, exist_ok=True)
+    polls = 0
+    while max_polls is None or polls < max_polls:
+        polls += 1
+        for path in _pending_files(drop_dir):
+            started = time.perf_counter()
+            try:
+                alerts = monitor.update(read_hourly_file(path))
+            except (ValueError, KeyError, pd.errors.ParserError) as e:
+                # a broken file must not stop the stream
+                alerts = []
+                if log:
+                    log(f'streaming: skipped {os.path.basename(path)}: {e}')
+            if alerts:
+                with open(alerts_path, 'a') as f:
+                    for alert in alerts:
+                        f.write(json.dumps(alert) + '\n')
+            shutil.move(path, os.path.join(done_dir, os.path.basename(path)))
+            if log:
+                log(f'streaming: {os.path.basename(path)} -> {len(alerts)} alerts '
+                    f'in {(time.perf_counter() - started) * 1000:.0f} ms')
+        time.sleep(interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Ingest hourly ARPA files as they arrive and write threshold alerts.')
+    parser.add_argument('--drop-dir', default=DROP_DIR, help='directory new hourly files are dropped into')
+    parser.add_argument('--alerts', default=ALERTS_PATH, help='JSON-lines file the alerts are appended to')
+    parser.add_argument('--stations', default=STATIONS_PATH, help='ARPA station list')
+    parser.add_argument('--pm25-threshold', type=float, default=ALARM_THRESHOLDS['pm25'])
+    parser.add_argument('--pm10-threshold', type=float, default=ALARM_THRESHOLDS['pm10'])
+    parser.add_argument('--retention-days', type=int, default=RETENTION_DAYS)
+    parser.add_argument('--interval', type=float, default=0.2, help='seconds between polls')
+    args = parser.parse_args(argv)
+
+    groups = station_groups(load_station_registry(args.stations))
+    thresholds = {'pm25': args.pm25_threshold, 'pm10': args.pm10_threshold}
+    monitor = StreamMonitor(groups, thresholds, args.retention_days)
+    log = lambda message: print(message, file=sys.stderr)
+    try:
+        watch(monitor, args.drop_dir, args.alerts, args.interval, log=log)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()